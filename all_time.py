@@ -1,9 +1,9 @@
-import matplotlib.pyplot as plt
+import io
 import os
 import pandas as pd
 
+from rpt import cache
 from rpt.stats_by_date import get_stats_by_date
-from rpt.stats_by_hw import get_stats_by_hw
 
 config = {
     "frame_folder": "frames",
@@ -13,8 +13,10 @@ config = {
 }
 
 
-def plot_all_time_report(config):
-    report = get_stats_by_date(config)[
+def render_all_time_chart(config, hw_stats: pd.DataFrame = None) -> bytes:
+    import matplotlib.pyplot as plt
+
+    report = get_stats_by_date(config, hw_stats=hw_stats)[
         ["reviewed", "new", "netlearned", "cumnew", "cumnetlearned"]
     ].copy()
 
@@ -52,6 +54,21 @@ def plot_all_time_report(config):
     )
     plt.xticks(rotation=30)
 
+    image = io.BytesIO()
+    plt.savefig(image, format="png")
+    plt.close()
+    return image.getvalue()
+
+
+def plot_all_time_report(config, hw_stats: pd.DataFrame = None):
+    image = cache.memoize(
+        config,
+        "all_time_chart",
+        lambda: render_all_time_chart(config, hw_stats),
+        kind="png",
+        hw_stats=hw_stats,
+    )
+
     image_path = os.path.join(
         config["image_folder"],
         "{}_{}.png".format(
@@ -59,9 +76,9 @@ def plot_all_time_report(config):
         ),
     )
 
-    plt.savefig(image_path)
+    with open(image_path, "wb") as f:
+        f.write(image)
 
 
 if __name__ == "__main__":
     plot_all_time_report(config)
-
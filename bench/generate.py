@@ -0,0 +1,199 @@
+"""
+Generates a series of synthetic Pleco Database snapshots
+
+Cards are added and reviewed day by day, and each day's backup is written to a
+dated folder like the ones the Pi keeps, with the pleco_flash_cards and
+pleco_flash_scores_1 tables laid out as Pleco has them. Days without study
+leave the database unchanged, as they do in Pleco. Cards can also be reset,
+which clears their scores until they are next reviewed.
+"""
+
+import argparse
+import datetime
+import numpy as np
+import os
+import sqlite3
+
+config = {
+    "db_folder": "bench_data",
+    "db_file": "Pleco Flashcard Database.pqb",
+    "start": "2019-01-01",
+    "days": 60,
+    "cards": 2000,
+    "new_cards_per_day": 20,
+    "reviews_per_day": 200,
+    "idle_probability": 0.1,
+    "resets_per_day": 0,
+    "headwords": 1500,
+    "seed": 0,
+}
+
+cards_schema = """
+CREATE TABLE pleco_flash_cards (
+    id INTEGER PRIMARY KEY, dictid INTEGER, dictentry INTEGER, hw TEXT, hy TEXT,
+    pron TEXT, defn TEXT, created INTEGER, modified INTEGER
+)
+"""
+
+scores_schema = """
+CREATE TABLE pleco_flash_scores_1 (
+    card INTEGER PRIMARY KEY, score INTEGER, difficulty INTEGER, history TEXT,
+    correct INTEGER, incorrect INTEGER, reviewed INTEGER, sincelastchange INTEGER,
+    firstreviewedtime INTEGER, lastreviewedtime INTEGER
+)
+"""
+
+
+def get_headwords(rng: np.random.RandomState, n: int) -> np.ndarray:
+    """
+    Gets n distinct one to three character headwords
+    """
+
+    hws = set()
+    while len(hws) < n:
+        length = rng.choice([1, 2, 2, 3])
+        hws.add("".join(chr(0x4E00 + c) for c in rng.randint(0, 3000, length)))
+    return np.array(sorted(hws), dtype=object)
+
+
+def get_snapshot_folder(start: datetime.date, day: int) -> str:
+    # Backups are taken at 3 in the morning, after the day's study
+    return (start + datetime.timedelta(days=day + 1)).strftime("%Y-%m-%d 03.00.00")
+
+
+def write_snapshot(db_file: str, cards: dict, scores: dict):
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    with sqlite3.connect(db_file) as db:
+        db.execute(cards_schema)
+        db.execute(scores_schema)
+        db.executemany(
+            "INSERT INTO pleco_flash_cards VALUES (?, ?, ?, ?, '', '', '', ?, ?)",
+            zip(
+                cards["id"].tolist(),
+                cards["dictid"].tolist(),
+                cards["dictentry"].tolist(),
+                cards["hw"].tolist(),
+                cards["created"].tolist(),
+                cards["created"].tolist(),
+            ),
+        )
+        reviewed = scores["reviewed"] > 0
+        db.executemany(
+            "INSERT INTO pleco_flash_scores_1 VALUES (?, 0, 0, ?, 0, 0, ?, 0, ?, ?)",
+            zip(
+                cards["id"][reviewed].tolist(),
+                scores["history"][reviewed].tolist(),
+                scores["reviewed"][reviewed].tolist(),
+                scores["firstreviewedtime"][reviewed].tolist(),
+                scores["lastreviewedtime"][reviewed].tolist(),
+            ),
+        )
+    db.close()
+
+
+def generate(config) -> list:
+    """
+    Writes a snapshot for each day, returning the snapshot folders
+    """
+
+    rng = np.random.RandomState(config["seed"])
+    start = datetime.date.fromisoformat(config["start"])
+    epoch = datetime.datetime.combine(start, datetime.time(), datetime.timezone.utc)
+    epoch = int(epoch.timestamp())
+
+    # Every card that will ever exist, only the first n of which exist on a day
+    n_cards = config["cards"] + config["new_cards_per_day"] * config["days"]
+    headwords = get_headwords(rng, config["headwords"])
+    hw = headwords[rng.randint(0, len(headwords), n_cards)]
+    # Some Pleco headwords carry @ markers, which the ETL strips
+    marked = rng.rand(n_cards) < 0.05
+    hw[marked] = [h[:1] + "@" + h[1:] for h in hw[marked]]
+    cards = {
+        "id": np.arange(1, n_cards + 1),
+        "dictid": rng.choice([1, 1, 1, 2], n_cards),
+        "dictentry": rng.permutation(n_cards * 4)[:n_cards],
+        "hw": hw,
+        "created": np.zeros(n_cards, dtype="i8"),
+    }
+    cards["created"][: config["cards"]] = epoch - rng.randint(
+        86400, 86400 * 365, config["cards"]
+    )
+    scores = {
+        "history": np.full(n_cards, "", dtype=object),
+        "reviewed": np.zeros(n_cards, dtype="i8"),
+        "firstreviewedtime": np.zeros(n_cards, dtype="i8"),
+        "lastreviewedtime": np.zeros(n_cards, dtype="i8"),
+    }
+
+    os.makedirs(config["db_folder"], exist_ok=True)
+    folders = []
+    n = config["cards"]
+    for day in range(config["days"]):
+        today = epoch + day * 86400
+        if rng.rand() >= config["idle_probability"]:
+            new = config["new_cards_per_day"]
+            cards["created"][n : n + new] = today + rng.randint(0, 86400, new)
+            n += new
+
+            if config.get("resets_per_day", 0) > 0:
+                reset = rng.randint(0, n, config["resets_per_day"])
+                scores["history"][reset] = ""
+                scores["reviewed"][reset] = 0
+
+            # Each review is a digit 1-6, 4 and up being correct, newest first
+            counts = np.bincount(
+                rng.randint(0, n, rng.poisson(config["reviews_per_day"])), minlength=n
+            )
+            for card in np.flatnonzero(counts):
+                digits = rng.choice(
+                    list("123456"), counts[card], p=[0.1] * 3 + [0.7 / 3] * 3
+                )
+                scores["history"][card] = "".join(digits) + scores["history"][card]
+                # A card added today can't be reviewed before it was created
+                times = np.sort(today + rng.randint(0, 86400, 2))
+                times = np.maximum(times, cards["created"][card])
+                if scores["reviewed"][card] == 0:
+                    scores["firstreviewedtime"][card] = times[0]
+                scores["lastreviewedtime"][card] = times[1]
+                scores["reviewed"][card] += counts[card]
+
+        folder = get_snapshot_folder(start, day)
+        os.makedirs(os.path.join(config["db_folder"], folder), exist_ok=True)
+        write_snapshot(
+            os.path.join(config["db_folder"], folder, config["db_file"]),
+            {c: v[:n] for c, v in cards.items()},
+            {c: v[:n] for c, v in scores.items()},
+        )
+        folders.append(folder)
+    return folders
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate Pleco Database snapshots")
+    parser.add_argument("--db-folder", default=config["db_folder"])
+    parser.add_argument("--start", default=config["start"])
+    parser.add_argument("--days", type=int, default=config["days"])
+    parser.add_argument("--cards", type=int, default=config["cards"])
+    parser.add_argument(
+        "--new-cards-per-day", type=int, default=config["new_cards_per_day"]
+    )
+    parser.add_argument(
+        "--reviews-per-day", type=int, default=config["reviews_per_day"]
+    )
+    parser.add_argument(
+        "--idle-probability", type=float, default=config["idle_probability"]
+    )
+    parser.add_argument("--resets-per-day", type=int, default=config["resets_per_day"])
+    parser.add_argument("--seed", type=int, default=config["seed"])
+    args = parser.parse_args()
+    config["db_folder"] = args.db_folder
+    config["start"] = args.start
+    config["days"] = args.days
+    config["cards"] = args.cards
+    config["new_cards_per_day"] = args.new_cards_per_day
+    config["reviews_per_day"] = args.reviews_per_day
+    config["idle_probability"] = args.idle_probability
+    config["resets_per_day"] = args.resets_per_day
+    config["seed"] = args.seed
+    print("Wrote {} snapshots".format(len(generate(config))))
@@ -0,0 +1,117 @@
+"""
+Benchmarks the columnar hw_events_stats pipeline against the original row-wise one
+"""
+
+import numpy as np
+import pandas as pd
+import time
+
+from etl import schema
+from etl.hw_events_stats import get_stats
+
+config = {"events": 1000000, "headwords": 20000, "days": 900, "seed": 0}
+
+
+def is_learned(row):
+    return row["daycorrect"] > 0 and row["dayincorrect"] == 0
+
+
+def get_net_learned(row):
+    if not pd.isna(row["laglearned"]) and row["learned"] == row["laglearned"]:
+        return 0
+    if pd.isna(row["laglearned"]) and not row["learned"]:
+        return 0
+    if row["learned"]:
+        return 1
+    return -1
+
+
+def get_stats_by_row(hw_events: pd.DataFrame) -> pd.DataFrame:
+    """
+    Original stats, computed with nested and row-wise apply calls
+    """
+
+    hw_events_stats = hw_events.copy()
+
+    hw_events_stats["invresult"] = hw_events_stats["result"].apply(lambda x: not x)
+    hw_events_stats["revieweddate"] = hw_events_stats["reviewedtime"].apply(
+        lambda x: x.date()
+    )
+    hw_events_stats["cumcorrect"] = (
+        hw_events_stats.groupby(["hw"])["result"]
+        .apply(lambda x: x.cumsum())
+        .astype("u2")
+    )
+    hw_events_stats["cumincorrect"] = (
+        hw_events_stats.groupby(["hw"])["result"]
+        .apply(lambda x: x.apply(lambda y: not y).cumsum())
+        .astype("u2")
+    )
+    hw_events_stats["daycorrect"] = (
+        hw_events_stats.groupby(["hw", "revieweddate"])["result"]
+        .transform("sum")
+        .astype("u2")
+    )
+    hw_events_stats["dayincorrect"] = (
+        hw_events_stats.groupby(["hw", "revieweddate"])["invresult"]
+        .transform("sum")
+        .astype("u2")
+    )
+    hw_events_stats["learned"] = hw_events_stats.apply(is_learned, axis=1)
+    hw_events_stats["laglearned"] = hw_events_stats.groupby(["hw"], as_index=False)[
+        "learned"
+    ].shift(1)
+    hw_events_stats["netlearned"] = hw_events_stats.apply(get_net_learned, axis=1)
+
+    return hw_events_stats
+
+
+def get_synthetic_hw_events(config) -> pd.DataFrame:
+    """
+    Builds a headword events frame shaped like hw_events.get_hw_events
+    """
+
+    rng = np.random.RandomState(config["seed"])
+    n = config["events"]
+
+    hw = np.array(["hw{:05d}".format(i) for i in range(config["headwords"])])
+    reviewedtime = pd.Timestamp("2017-04-01").value + rng.randint(
+        0, config["days"] * 86400, n
+    ).astype("i8") * (10 ** 9)
+
+    hw_events = pd.DataFrame(
+        {
+            "hw": hw[rng.randint(0, len(hw), n)],
+            "reviewedtime": reviewedtime.view("M8[ns]"),
+            "result": rng.rand(n) < 0.7,
+        }
+    )
+    hw_events.sort_values(by=["hw", "reviewedtime", "result"], inplace=True)
+    hw_events.reset_index(drop=True, inplace=True)
+    hw_events["occurrence"] = hw_events.groupby(["hw"]).cumcount()
+    hw_events.set_index(["hw", "occurrence"], inplace=True)
+    return hw_events
+
+
+def run(config):
+    hw_events = get_synthetic_hw_events(config)
+
+    timings = {}
+    results = {}
+    for name, fn in [("by_row", get_stats_by_row), ("columnar", get_stats)]:
+        start = time.perf_counter()
+        results[name] = fn(hw_events)
+        timings[name] = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(
+        schema.conform(results["by_row"], "hw_events_stats"), results["columnar"]
+    )
+
+    print("{} events".format(len(hw_events.index)))
+    for name, seconds in timings.items():
+        print("{:>10}: {:8.3f}s".format(name, seconds))
+    print("{:>10}: {:8.1f}x".format("speedup", timings["by_row"] / timings["columnar"]))
+
+
+if __name__ == "__main__":
+    run(config)
@@ -0,0 +1,125 @@
+"""
+Benchmarks the vectorized interpolate_events against the original per-card path
+"""
+
+import numpy as np
+import pandas as pd
+import time
+
+from etl import schema
+from etl.card_events import interpolate_events
+
+config = {"cards": 1000, "max_reviewed": 40, "seed": 0}
+
+
+def interpolate_row_events(group: pd.DataFrame) -> pd.DataFrame:
+    """
+    Original per-card interpolation (needs a pandas with DataFrame.append)
+    """
+
+    events = pd.DataFrame(columns=["reviewedtime", "result"])
+
+    row = group.iloc[0].copy()
+    reviewed = row["reviewed"]
+
+    if reviewed == 0:
+        return events
+
+    firstreviewedtime = row["firstreviewedtime"]
+    lastreviewedtime = row["lastreviewedtime"]
+    history = str(row["history"])[::-1]
+    cumreviewed = row["cumreviewed"]
+
+    duration = lastreviewedtime - firstreviewedtime
+    interval = duration / reviewed
+    for i in range(reviewed):
+        reviewed_time = firstreviewedtime + (interval * (i + 1))
+        result = int(history[i]) >= 4
+        events = events.append(
+            {"reviewedtime": reviewed_time, "result": result}, ignore_index=True
+        )
+
+    events.index = events.index + (cumreviewed - reviewed)
+    events.index.name = "occurrence"
+    return events
+
+
+def interpolate_events_by_card(scores: pd.DataFrame) -> pd.DataFrame:
+    """
+    Original interpolation, one groupby-apply call per card
+    """
+
+    inc_scores = scores.query("reviewed > 0").copy()
+    inc_scores.sort_index(inplace=True)
+    return inc_scores.groupby(["dictid", "dictentry", "hw", "created"]).apply(
+        interpolate_row_events
+    )
+
+
+def get_synthetic_scores(config) -> pd.DataFrame:
+    """
+    Builds a scores frame shaped like card_events.get_scores
+    """
+
+    rng = np.random.RandomState(config["seed"])
+    n = config["cards"]
+
+    created = pd.Timestamp("2017-04-01") + pd.to_timedelta(
+        rng.randint(0, 365 * 86400, n), unit="s"
+    )
+    firstreviewedtime = created + pd.to_timedelta(rng.randint(0, 86400, n), unit="s")
+    lastreviewedtime = firstreviewedtime + pd.to_timedelta(
+        rng.randint(0, 2 * 365 * 86400, n), unit="s"
+    )
+    reviewed = rng.randint(0, config["max_reviewed"] + 1, n).astype("u4")
+    history = [
+        "".join(map(str, rng.randint(1, 7, r))) if r > 0 else np.nan for r in reviewed
+    ]
+
+    scores = pd.DataFrame(
+        {
+            "dictid": 1,
+            "dictentry": np.arange(n),
+            "hw": ["hw{}".format(i % (n // 2 + 1)) for i in range(n)],
+            "created": created,
+            "firstreviewedtime": firstreviewedtime,
+            "lastreviewedtime": lastreviewedtime,
+            "reviewed": reviewed,
+            "cumreviewed": reviewed,
+            "history": history,
+        }
+    )
+    scores.set_index(["dictid", "dictentry", "hw", "created"], inplace=True)
+    scores.sort_index(inplace=True)
+    return scores
+
+
+def run(config):
+    scores = get_synthetic_scores(config)
+    n_events = int(scores["reviewed"].sum())
+
+    timings = {}
+    results = {}
+    for name, fn in [
+        ("by_card", interpolate_events_by_card),
+        ("vectorized", interpolate_events),
+    ]:
+        start = time.perf_counter()
+        results[name] = fn(scores)
+        timings[name] = time.perf_counter() - start
+
+    # The original path left results as objects
+    pd.testing.assert_frame_equal(
+        schema.conform(results["by_card"], "card_events"), results["vectorized"]
+    )
+
+    print("{} cards, {} events".format(len(scores.index), n_events))
+    for name, seconds in timings.items():
+        print("{:>12}: {:8.3f}s".format(name, seconds))
+    print(
+        "{:>12}: {:8.1f}x".format("speedup", timings["by_card"] / timings["vectorized"])
+    )
+
+
+if __name__ == "__main__":
+    run(config)
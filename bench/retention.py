@@ -0,0 +1,75 @@
+"""
+Benchmarks fitting the forgetting curves of a whole vocabulary, and checks the
+fit recovers the half-lives the reviews were simulated with
+"""
+
+import numpy as np
+import pandas as pd
+import time
+
+from etl import retention
+
+config = {"events": 1000000, "headwords": 20000, "days": 900, "seed": 0}
+
+
+def get_simulated_hw_events(config) -> tuple:
+    """
+    Simulates reviews of headwords with known half-lives, returning a headword
+    events frame and the half-lives
+    """
+
+    rng = np.random.RandomState(config["seed"])
+    n = config["events"]
+    half_lives = np.exp(rng.normal(np.log(5), 1, config["headwords"]))
+
+    codes = np.sort(rng.randint(0, config["headwords"], n))
+    seconds = rng.randint(0, config["days"] * 86400, n).astype("i8")
+    order = np.lexsort([seconds, codes])
+    codes = codes[order]
+    seconds = seconds[order]
+
+    # A headword's first review is recalled, as far as the fit cares
+    first = np.diff(codes, prepend=-1) != 0
+    lags = np.where(first, 0, np.diff(seconds, prepend=seconds[0]) / 86400)
+    recall = np.exp2(-lags / half_lives[codes])
+    result = rng.random_sample(n) < recall
+
+    hws = pd.Categorical.from_codes(
+        codes, ["hw{:05d}".format(i) for i in range(config["headwords"])]
+    )
+    occurrence = np.arange(n) - np.searchsorted(codes, codes)
+    hw_events = pd.DataFrame(
+        {
+            "reviewedtime": pd.Timestamp("2017-04-01") + pd.to_timedelta(seconds, "s"),
+            "result": result,
+        },
+        index=pd.MultiIndex.from_arrays([hws, occurrence], names=["hw", "occurrence"]),
+    )
+    return hw_events, half_lives
+
+
+def run(config):
+    hw_events, half_lives = get_simulated_hw_events(config)
+    summaries = retention.get_summaries(hw_events)
+
+    for workers in [1, 4]:
+        fit_config = dict(retention.config, workers=workers)
+        start = time.perf_counter()
+        _, lags, results = retention.get_reviews(hw_events, fit_config["min_lag_hours"])
+        prior = retention.fit_prior(fit_config, lags, results)
+        fitted = retention.get_retention(fit_config, hw_events, summaries, prior)
+        seconds = time.perf_counter() - start
+        print(
+            "{} worker(s): {:,} events, {:,} headwords in {:.2f}s".format(
+                workers, len(hw_events.index), len(fitted.index), seconds
+            )
+        )
+
+    error = np.abs(np.log(fitted["halflife"].values / half_lives))
+    print(
+        "Median half-life error: {:.0f}%".format((np.exp(np.median(error)) - 1) * 100)
+    )
+
+
+if __name__ == "__main__":
+    run(config)
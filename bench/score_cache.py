@@ -0,0 +1,79 @@
+"""
+Checks card events come out the same whether or not the score cache survives
+between runs
+
+Snapshots with reset cards are processed one at a time, once keeping the score
+cache (warm) and once clearing it before every run (cold), as after an upgrade
+or an eviction. A reset card's running review count is only in the cache, so a
+cold run has to restore it from the saved card events.
+"""
+
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+
+from bench import generate
+from etl import card_events, score_cache, store
+
+config = {"days": 20, "cards": 300, "reviews_per_day": 150, "resets_per_day": 10}
+
+
+def process_one_at_a_time(root: str, snapshots: str, cold: bool) -> pd.DataFrame:
+    """
+    Processes the snapshots in order as they would arrive, returning the saved
+    card events
+    """
+
+    process_config = dict(
+        card_events.config,
+        db_folder=os.path.join(root, "data"),
+        frame_folder=os.path.join(root, "frames"),
+    )
+    cache_folder = os.path.join(
+        process_config["frame_folder"], score_cache.config["score_cache_folder"]
+    )
+    for f in sorted(os.listdir(snapshots)):
+        shutil.copytree(
+            os.path.join(snapshots, f), os.path.join(process_config["db_folder"], f)
+        )
+        if cold:
+            shutil.rmtree(cache_folder, ignore_errors=True)
+        card_events.process(process_config)
+    return store.read_dataset(process_config, process_config["events_file"])
+
+
+def run(config):
+    folder = tempfile.mkdtemp()
+    try:
+        snapshots = os.path.join(folder, "snapshots")
+        generate.generate(
+            dict(
+                generate.config,
+                db_folder=snapshots,
+                days=config["days"],
+                cards=config["cards"],
+                reviews_per_day=config["reviews_per_day"],
+                resets_per_day=config["resets_per_day"],
+            )
+        )
+        warm = process_one_at_a_time(os.path.join(folder, "warm"), snapshots, False)
+        cold = process_one_at_a_time(os.path.join(folder, "cold"), snapshots, True)
+    finally:
+        shutil.rmtree(folder)
+
+    try:
+        pd.testing.assert_frame_equal(warm, cold)
+    except AssertionError as e:
+        print("Cold cache events differ from warm: {}".format(e))
+        sys.exit(1)
+    print(
+        "{} snapshots, {:,} events the same with a cold score cache".format(
+            config["days"], len(warm.index)
+        )
+    )
+
+
+if __name__ == "__main__":
+    run(config)
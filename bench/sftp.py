@@ -0,0 +1,351 @@
+"""
+Checks etl.download against a local SFTP stand-in for the Raspberry Pi
+
+The stand-in serves generated databases from a temporary folder, answers the
+sha256sum command downloads use to verify them, and sits behind a relay that
+delays every packet, so a download that waits on each read shows up as slow.
+"""
+
+import hashlib
+import os
+import paramiko
+import queue
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from etl import download
+
+config = {"folders": 3, "size": 2 ** 21, "latency": 0.02, "seed": 0}
+
+remote_folder = "/PlecoDatabase"
+
+
+class StandIn(paramiko.ServerInterface):
+    """
+    Accepts any client key, and runs sha256sum over files under root
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "publickey"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        paths = command.decode("utf8").split("'")[1::2]
+        lines = []
+        for path in paths:
+            with open(self.root + path, "rb") as f:
+                lines.append(
+                    "{}  {}\n".format(hashlib.sha256(f.read()).hexdigest(), path)
+                )
+
+        # paramiko answers the request after this returns, and output arriving
+        # before the answer makes the client give up on the channel
+        def reply():
+            time.sleep(0.1)
+            channel.sendall("".join(lines).encode("utf8"))
+            channel.send_exit_status(0)
+            channel.close()
+
+        threading.Thread(target=reply, daemon=True).start()
+        return True
+
+
+class Folder(paramiko.SFTPServerInterface):
+    """
+    Serves the files under the root its server was started with, read only
+    """
+
+    def __init__(self, server: StandIn, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = server.root
+
+    def list_folder(self, path):
+        attributes = []
+        for f in os.listdir(self.root + path):
+            a = paramiko.SFTPAttributes.from_stat(
+                os.stat(os.path.join(self.root + path, f))
+            )
+            a.filename = f
+            attributes.append(a)
+        return attributes
+
+    def stat(self, path):
+        return paramiko.SFTPAttributes.from_stat(os.stat(self.root + path))
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        handle = paramiko.SFTPHandle(flags)
+        handle.filename = self.root + path
+        handle.readfile = open(self.root + path, "rb")
+        return handle
+
+
+def serve(listener: socket.socket, root: str, host_key: paramiko.PKey):
+    while True:
+        conn, _ = listener.accept()
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, Folder)
+        transport.start_server(server=StandIn(root))
+
+
+def pump(source: socket.socket, target: socket.socket, latency: float):
+    """
+    Forwards bytes from source to target, each arriving latency seconds late
+    """
+
+    pending = queue.Queue()
+
+    def send():
+        while True:
+            due, data = pending.get()
+            time.sleep(max(0, due - time.perf_counter()))
+            try:
+                if not data:
+                    target.shutdown(socket.SHUT_WR)
+                    return
+                target.sendall(data)
+            except OSError:
+                # The other end has already gone
+                return
+
+    threading.Thread(target=send, daemon=True).start()
+    while True:
+        try:
+            data = source.recv(65536)
+        except OSError:
+            data = b""
+        pending.put((time.perf_counter() + latency, data))
+        if not data:
+            return
+
+
+def relay(listener: socket.socket, server_port: int, latency: float):
+    while True:
+        client, _ = listener.accept()
+        server = socket.create_connection(("127.0.0.1", server_port))
+        for source, target in [(client, server), (server, client)]:
+            threading.Thread(
+                target=pump, args=(source, target, latency), daemon=True
+            ).start()
+
+
+def listen() -> socket.socket:
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+    return listener
+
+
+def start(config, folder: str) -> dict:
+    """
+    Starts the stand-in and its relay, returning the download config to use
+    """
+
+    root = os.path.join(folder, "remote")
+    os.makedirs(root + remote_folder)
+    seed = config["seed"]
+    for i in range(config["folders"]):
+        snapshot = os.path.join(
+            root + remote_folder, "2019-02-{:02d} 03.00.00".format(i + 1)
+        )
+        os.mkdir(snapshot)
+        with open(os.path.join(snapshot, download.config["db_file"]), "wb") as f:
+            f.write(
+                hashlib.shake_256("{}-{}".format(seed, i).encode("utf8")).digest(
+                    config["size"]
+                )
+            )
+
+    host_key = paramiko.RSAKey.generate(2048)
+    server = listen()
+    threading.Thread(target=serve, args=(server, root, host_key), daemon=True).start()
+    proxy = listen()
+    port = proxy.getsockname()[1]
+    threading.Thread(
+        target=relay,
+        args=(proxy, server.getsockname()[1], config["latency"]),
+        daemon=True,
+    ).start()
+
+    key_file = os.path.join(folder, "key")
+    paramiko.RSAKey.generate(2048).write_private_key_file(key_file)
+    known_hosts_file = os.path.join(folder, "known_hosts")
+    with open(known_hosts_file, "w") as f:
+        f.write(
+            "[127.0.0.1]:{} {} {}\n".format(
+                port, host_key.get_name(), host_key.get_base64()
+            )
+        )
+
+    return dict(
+        download.config,
+        remote_host="127.0.0.1",
+        remote_port=port,
+        remote_key_file=key_file,
+        known_hosts_file=known_hosts_file,
+        remote_folder=remote_folder,
+        local_folder=os.path.join(folder, "local"),
+        remote_root=root,
+    )
+
+
+def get_remote_path(download_config, f: str) -> str:
+    return download_config["remote_root"] + download.get_remote_file(download_config, f)
+
+
+def check_downloaded(download_config, folders: list):
+    for f in folders:
+        with open(download.get_local_file(download_config, f), "rb") as local:
+            with open(get_remote_path(download_config, f), "rb") as remote:
+                assert local.read() == remote.read(), "{} differs".format(f)
+
+
+def reset_local(download_config):
+    shutil.rmtree(download_config["local_folder"], ignore_errors=True)
+    os.mkdir(download_config["local_folder"])
+
+
+def check_download(config, download_config) -> str:
+    reset_local(download_config)
+    downloaded = download.process(download_config)
+    assert len(downloaded) == config["folders"], downloaded
+    check_downloaded(download_config, downloaded)
+    assert download.process(download_config) == [], "downloaded twice"
+    return "{} folders".format(len(downloaded))
+
+
+def time_download(download_config, f: str, resume_from: int) -> float:
+    """
+    Times downloading a folder's database over an open connection, resuming
+    from a .part file holding its first resume_from bytes
+    """
+
+    local_file = download.get_local_file(download_config, f)
+    os.remove(local_file)
+    if resume_from > 0:
+        with open(get_remote_path(download_config, f), "rb") as remote:
+            with open(local_file + ".part", "wb") as part:
+                part.write(remote.read(resume_from))
+
+    with download.connect(download_config) as ssh_client:
+        with ssh_client.open_sftp() as sftp_client:
+            start = time.perf_counter()
+            download.download_file(
+                download_config,
+                ssh_client,
+                sftp_client,
+                download.get_remote_file(download_config, f),
+                local_file,
+            )
+            seconds = time.perf_counter() - start
+    check_downloaded(download_config, [f])
+    return seconds
+
+
+def check_resume(config, download_config) -> str:
+    """
+    A download resumed halfway should still be prefetched, so it takes no longer
+    than a whole download rather than a round trip for each 32 KB read
+    """
+
+    f = sorted(os.listdir(download_config["remote_root"] + remote_folder))[-1]
+    whole = time_download(download_config, f, 0)
+    resumed = time_download(download_config, f, config["size"] // 2)
+    assert resumed < whole * 2, "resumed in {:.2f}s, whole in {:.2f}s".format(
+        resumed, whole
+    )
+    return "resumed in {:.2f}s, whole in {:.2f}s".format(resumed, whole)
+
+
+def check_recheck(config, download_config) -> str:
+    f = sorted(os.listdir(download_config["remote_root"] + remote_folder))[0]
+    local_file = download.get_local_file(download_config, f)
+    with open(local_file, "r+b") as local:
+        local.truncate(100)
+    assert download.process(download_config) == [], "truncated file noticed"
+    downloaded = download.process(dict(download_config, recheck_sizes=True))
+    assert downloaded == [f], downloaded
+    check_downloaded(download_config, downloaded)
+    return "truncated {} downloaded again".format(f)
+
+
+def check_hash_rejection(config, download_config) -> str:
+    f = sorted(os.listdir(download_config["remote_root"] + remote_folder))[0]
+    local_file = download.get_local_file(download_config, f)
+    os.remove(local_file)
+    with open(local_file + ".part", "wb") as part:
+        part.write(b"\0" * (config["size"] // 2))
+
+    verify_config = dict(download_config, verify_hash=True)
+    try:
+        download.process(verify_config)
+    except IOError:
+        pass
+    else:
+        raise AssertionError("corrupt .part accepted")
+    assert not os.path.exists(local_file), "corrupt file renamed into place"
+    assert not os.path.exists(local_file + ".part"), "corrupt .part kept"
+
+    assert download.process(verify_config) == [f], "not downloaded again"
+    check_downloaded(download_config, [f])
+    return "corrupt .part rejected, then downloaded again"
+
+
+def check_skip_identical(config, download_config) -> str:
+    folders = sorted(os.listdir(download_config["remote_root"] + remote_folder))
+    shutil.copyfile(
+        get_remote_path(download_config, folders[0]),
+        get_remote_path(download_config, folders[1]),
+    )
+    reset_local(download_config)
+    downloaded = download.process(dict(download_config, skip_identical=True))
+    assert downloaded == folders, downloaded
+    check_downloaded(download_config, downloaded)
+    return "{} copied from {}".format(folders[1], folders[0])
+
+
+checks = [
+    check_download,
+    check_resume,
+    check_recheck,
+    check_hash_rejection,
+    check_skip_identical,
+]
+
+
+def run(config):
+    folder = tempfile.mkdtemp()
+    failed = False
+    try:
+        download_config = start(config, folder)
+        for check in checks:
+            try:
+                print(
+                    "{}: ok, {}".format(check.__name__, check(config, download_config))
+                )
+            except (AssertionError, IOError) as e:
+                failed = True
+                print("{}: failed, {}".format(check.__name__, e))
+    finally:
+        shutil.rmtree(folder)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run(config)
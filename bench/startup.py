@@ -0,0 +1,76 @@
+"""
+Checks the command line's quick commands start within budget, and that the
+report modules leave their heavy dependencies unimported until they are used
+"""
+
+import json
+import subprocess
+import sys
+import time
+
+config = {"budget": 0.5, "repeats": 5}
+
+heavy = ["pandas", "matplotlib", "googleapiclient", "google_auth_oauthlib", "pinyin"]
+
+# command -> modules it mustn't import
+imports = {
+    "import pleco.__main__ as cli; cli.main(['status'])": heavy,
+    "import all_time": ["matplotlib", "pinyin"],
+    "import weekly_vocab": ["googleapiclient", "google_auth_oauthlib", "pinyin"],
+}
+
+
+def get_startup_time(args: list, repeats: int) -> float:
+    """
+    Gets the fastest of several runs of python -m pleco with the arguments
+    """
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "pleco"] + args, check=True, capture_output=True
+        )
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def get_imported(code: str, modules: list) -> list:
+    check = (
+        "{}; import sys, json; print(json.dumps([m for m in {} if m in sys.modules]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", check.format(code, modules)],
+        check=True,
+        capture_output=True,
+    )
+    return json.loads(result.stdout.decode("utf8").splitlines()[-1])
+
+
+def run(config):
+    failed = False
+    for args in [["--help"], ["status"], ["etl", "--help"]]:
+        seconds = get_startup_time(args, config["repeats"])
+        within = seconds < config["budget"]
+        failed = failed or not within
+        print(
+            "{:>20}: {:6.3f}s {}".format(
+                " ".join(args), seconds, "ok" if within else "over budget"
+            )
+        )
+
+    for code, modules in imports.items():
+        imported = get_imported(code, modules)
+        failed = failed or len(imported) > 0
+        print(
+            "{}: {}".format(
+                code, "imports " + ", ".join(imported) if imported else "ok"
+            )
+        )
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run(config)
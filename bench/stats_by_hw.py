@@ -0,0 +1,162 @@
+"""
+Benchmarks the grouped stats_by_hw report against the original head/tail one
+
+The grouped report is timed as the reports run it, reading the per-headword
+weekly rollup and the days around it from saved frames, and with the stats
+handed to it in memory. The original reads its pickle of the whole stats, as
+it did before.
+"""
+
+import numpy as np
+import os
+import pandas as pd
+import pinyin
+import pinyin.cedict
+import tempfile
+import time
+
+from bench.hw_events_stats import get_synthetic_hw_events
+from etl import hw_events_stats
+from rpt import loader, stats_by_hw
+
+config = {"events": 1000000, "headwords": 20000, "days": 900, "seed": 0}
+
+
+def get_stats_by_hw_by_row(
+    config, start: pd.Timestamp = None, end: pd.Timestamp = None
+) -> pd.DataFrame:
+    """
+    Original report, with a head/tail pass per column group and row-wise applies
+    """
+
+    stats_file = os.path.join(config["frame_folder"], config["original_stats_file"])
+    stats = pd.read_pickle(stats_file)
+    # The pickle's dates are objects, so they're compared as dates
+    if start is not None:
+        stats = stats[stats["revieweddate"] >= start.date()].copy()
+    if end is not None:
+        stats = stats[stats["revieweddate"] < end.date()].copy()
+
+    first_review = stats.groupby(["hw"]).head(1).reset_index().set_index("hw").copy()
+    last_review = stats.groupby(["hw"]).tail(1).reset_index().set_index("hw").copy()
+
+    first_change = (
+        stats[stats["netlearned"] != 0]
+        .groupby(["hw"])
+        .head(1)
+        .reset_index()
+        .set_index("hw")
+        .copy()
+    )
+    last_change = (
+        stats[stats["netlearned"] != 0]
+        .groupby(["hw"])
+        .tail(1)
+        .reset_index()
+        .set_index("hw")
+        .copy()
+    )
+
+    rpt = pd.DataFrame({"reviewed": stats.groupby(["hw"]).size().astype("u2")})
+
+    rpt["firstreviewed"] = first_review["revieweddate"]
+    rpt["lastreviewed"] = last_review["revieweddate"]
+
+    rpt["correct"] = stats.groupby(["hw"])[["result"]].sum().astype("u2")
+    rpt["incorrect"] = stats.groupby(["hw"])[["invresult"]].sum().astype("u2")
+
+    rpt["new"] = first_review["occurrence"].apply(lambda x: x == 0)
+    rpt["knew"] = first_review["laglearned"].apply(lambda x: x == True)
+    rpt["learned"] = first_change["netlearned"].apply(lambda x: x == 1)
+    rpt["forgot"] = first_change["netlearned"].apply(lambda x: x == -1)
+
+    rpt["knew"] = rpt["knew"].fillna(False)
+    rpt["learned"] = rpt["learned"].fillna(False)
+    rpt["forgot"] = rpt["forgot"].fillna(False)
+
+    rpt["know"] = rpt.apply(
+        lambda row: row["learned"] or (row["knew"] and not row["forgot"]), axis=1
+    )
+
+    rpt["pinyin"] = rpt.apply(lambda row: pinyin.get(row.name), axis=1)
+    rpt["definition"] = rpt.apply(
+        lambda row: pinyin.cedict.translate_word(row.name), axis=1
+    )
+
+    return rpt
+
+
+def get_stats_by_hw_saved(config, start=None, end=None) -> pd.DataFrame:
+    # Each call reads from disk, like a report run in its own process
+    loader.cache.clear()
+    return stats_by_hw.get_stats_by_hw(config, start, end)
+
+
+def run(config):
+    hw_stats = hw_events_stats.get_stats(get_synthetic_hw_events(config))
+    first = hw_stats["revieweddate"].min()
+    last = hw_stats["revieweddate"].max()
+    half = first + pd.Timedelta(days=config["days"] // 2)
+    windows = [
+        (None, None),
+        (half, None),
+        # Starting and ending mid-week, so the days around the weeks are read too
+        (half + pd.Timedelta(days=3), last - pd.Timedelta(days=10)),
+    ]
+
+    # The stats and their rollups are saved as the ETL saves them, along with the
+    # pickle the original report read, with dates as objects and laglearned as
+    # nullable objects. The headword enrichment cache is written there too.
+    frame_folder = tempfile.TemporaryDirectory()
+    stats_config = dict(hw_events_stats.config, frame_folder=frame_folder.name)
+    hw_events_stats.save(stats_config, hw_stats)
+    original_stats = hw_stats.sort_values(by="revieweddate", kind="mergesort")
+    original_stats["revieweddate"] = original_stats["revieweddate"].dt.date
+    laglearned = original_stats["laglearned"].astype(object)
+    original_stats["laglearned"] = laglearned.where(laglearned.notna(), np.nan)
+    original_stats.to_pickle(os.path.join(frame_folder.name, "original_stats.pickle"))
+
+    config = dict(
+        stats_by_hw.config,
+        **config,
+        frame_folder=frame_folder.name,
+        original_stats_file="original_stats.pickle",
+    )
+
+    timings = {}
+    results = {}
+    for name, fn in [
+        ("by_row", lambda s, e: get_stats_by_hw_by_row(config, s, e)),
+        ("saved", lambda s, e: get_stats_by_hw_saved(config, s, e)),
+        ("in_memory", lambda s, e: stats_by_hw.get_stats_by_hw(config, s, e, hw_stats)),
+    ]:
+        start = time.perf_counter()
+        results[name] = [fn(s, e) for s, e in windows]
+        timings[name] = time.perf_counter() - start
+
+    # The original had no forgetting curves, and none are saved in the bench's
+    # frame folder
+    recall_columns = ["halflife", "recall"]
+    for name in ["saved", "in_memory"]:
+        for original, grouped in zip(results["by_row"], results[name]):
+            assert grouped[recall_columns].isna().all(axis=None)
+            pd.testing.assert_frame_equal(
+                original, grouped.drop(columns=recall_columns)
+            )
+
+    print(
+        "{} events, all time, last half and a mid-week window".format(
+            len(hw_stats.index)
+        )
+    )
+    for name, seconds in timings.items():
+        print(
+            "{:>10}: {:8.3f}s {:8.1f}x".format(
+                name, seconds, timings["by_row"] / seconds
+            )
+        )
+    frame_folder.cleanup()
+
+
+if __name__ == "__main__":
+    run(config)
@@ -0,0 +1,130 @@
+"""
+Benchmarks the ETL stages and reports end to end on generated snapshots
+
+At each scale a snapshot series is generated, every snapshot but the last is
+processed as a backfill, and then the last one as a nightly run. Each stage's
+time and memory is appended to the results' metrics file under
+<scale>/<run>/<stage>, so suite runs can be compared with
+
+    python -m etl.metrics --frame-folder bench_results --metrics-file suite.jsonl
+"""
+
+import argparse
+import os
+import pandas as pd
+import shutil
+import tempfile
+
+from bench import generate
+from etl import card_events, hw_events, hw_events_stats, metrics, retention
+from rpt import loader
+from rpt.stats_by_date import get_stats_by_date
+from rpt.stats_by_hw import get_stats_by_hw
+
+config = {
+    "results_folder": "bench_results",
+    "metrics_file": "suite.jsonl",
+    "scales": ["small", "medium"],
+    "frame_format": "parquet",
+    "workers": 1,
+}
+
+scales = {
+    "small": {"days": 30, "cards": 1000, "reviews_per_day": 100},
+    "medium": {"days": 120, "cards": 5000, "reviews_per_day": 400},
+    "large": {"days": 365, "cards": 20000, "reviews_per_day": 1000},
+}
+
+
+def run_stages(config, results_config, prefix: str) -> list:
+    """
+    Runs each stage and report once, returning their metrics records
+    """
+
+    stages = [
+        (
+            "card_events",
+            lambda: card_events.process(dict(card_events.config, **config)),
+        ),
+        ("hw_events", lambda: hw_events.process(dict(hw_events.config, **config))),
+        (
+            "hw_events_stats",
+            lambda: hw_events_stats.process(dict(hw_events_stats.config, **config)),
+        ),
+        ("retention", lambda: retention.process(dict(retention.config, **config))),
+        ("stats_by_date", lambda: get_stats_by_date(config)),
+        # Loading the CEDICT dictionary would swamp the report itself
+        ("stats_by_hw", lambda: get_stats_by_hw(config, definitions=False)),
+    ]
+
+    records = []
+    for name, run in stages:
+        with metrics.measure(results_config, prefix + name) as record:
+            result = run()
+            if isinstance(result, pd.DataFrame):
+                record["rows_out"] = len(result.index)
+        records.append(record)
+    return records
+
+
+def run_scale(config, results_config, scale: str) -> list:
+    folder = tempfile.mkdtemp()
+    try:
+        db_folder = os.path.join(folder, "data")
+        folders = generate.generate(
+            dict(generate.config, db_folder=db_folder, **scales[scale])
+        )
+        stage_config = {
+            "db_folder": db_folder,
+            "frame_folder": os.path.join(folder, "frames"),
+            "frame_format": config["frame_format"],
+            "workers": config["workers"],
+            "hw_events_stats_file": "hw_events_stats.pickle",
+        }
+        os.mkdir(stage_config["frame_folder"])
+
+        # The last snapshot is held back from the backfill for the nightly run
+        last = os.path.join(db_folder, folders[-1])
+        shutil.move(last, last + ".pending")
+        records = run_stages(stage_config, results_config, scale + "/backfill/")
+        shutil.move(last + ".pending", last)
+        loader.cache.clear()
+        records += run_stages(stage_config, results_config, scale + "/nightly/")
+        loader.cache.clear()
+        return records
+    finally:
+        shutil.rmtree(folder)
+
+
+def run(config):
+    results_config = {
+        "frame_folder": config["results_folder"],
+        "metrics_file": config["metrics_file"],
+    }
+
+    records = []
+    for scale in config["scales"]:
+        records += run_scale(config, results_config, scale)
+
+    results = pd.DataFrame(records).set_index("stage")
+    results["peak_rss"] = results["peak_rss"] / 2 ** 20
+    with pd.option_context("display.width", 200):
+        print(results[["wall", "cpu", "peak_rss", "rows_out"]].round(3))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ETL and reports")
+    parser.add_argument(
+        "--scales", nargs="*", default=config["scales"], choices=list(scales)
+    )
+    parser.add_argument("--results-folder", default=config["results_folder"])
+    parser.add_argument(
+        "--format", default=config["frame_format"], choices=["parquet", "pickle"]
+    )
+    parser.add_argument("--workers", type=int, default=config["workers"])
+    args = parser.parse_args()
+    config["scales"] = args.scales
+    config["results_folder"] = args.results_folder
+    config["frame_format"] = args.format
+    config["workers"] = args.workers
+    run(config)
@@ -0,0 +1,78 @@
+"""
+Benchmarks the transition table epoch conversion against the pandas tz chain,
+and checks the two agree around every DST change
+"""
+
+import numpy as np
+import pandas as pd
+import time
+
+from etl import tz
+
+config = {"times": 2000000, "timezone": "America/Toronto", "seed": 0}
+
+
+def from_epoch_seconds_by_pandas(seconds: np.ndarray, timezone: str) -> np.ndarray:
+    """
+    Original conversion, through tz-aware intermediates
+    """
+
+    return (
+        pd.to_datetime(pd.Series(seconds), unit="s")
+        .dt.tz_localize("UTC")
+        .dt.tz_convert(timezone)
+        .dt.tz_localize(None)
+        .values
+    )
+
+
+def get_dst_seconds(timezone: str) -> np.ndarray:
+    """
+    Gets the seconds around each transition from 1970 to 2037, with a missing one
+    """
+
+    starts, _ = tz.get_transitions(timezone)
+    seconds = starts[(starts >= 0) & (starts < 2 ** 31 * 10 ** 9)] // 10 ** 9
+    around = np.array([-3601, -3600, -1, 0, 1, 3599, 3600], dtype="i8")
+    seconds = (seconds[:, np.newaxis] + around).ravel().astype("f8")
+    return np.append(seconds, np.nan)
+
+
+def check_dst(config):
+    seconds = get_dst_seconds(config["timezone"])
+    with np.errstate(invalid="ignore"):
+        expected = from_epoch_seconds_by_pandas(seconds, config["timezone"])
+    np.testing.assert_array_equal(
+        expected, tz.from_epoch_seconds(seconds, config["timezone"])
+    )
+    print("{} times around DST changes agree".format(len(seconds)))
+
+
+def run(config):
+    check_dst(config)
+
+    rng = np.random.default_rng(config["seed"])
+    seconds = rng.integers(1.2e9, 1.8e9, config["times"]).astype("f8")
+
+    timings = {}
+    results = {}
+    for name, fn in [
+        ("pandas", from_epoch_seconds_by_pandas),
+        ("transitions", tz.from_epoch_seconds),
+    ]:
+        start = time.perf_counter()
+        results[name] = fn(seconds, config["timezone"])
+        timings[name] = time.perf_counter() - start
+
+    np.testing.assert_array_equal(results["pandas"], results["transitions"])
+
+    print("{} times".format(len(seconds)))
+    for name, seconds in timings.items():
+        print("{:>12}: {:8.3f}s".format(name, seconds))
+    print(
+        "{:>12}: {:8.1f}x".format("speedup", timings["pandas"] / timings["transitions"])
+    )
+
+
+if __name__ == "__main__":
+    run(config)
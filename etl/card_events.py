@@ -1,16 +1,31 @@
+import argparse
+import collections
+import contextlib
+import functools
 import numpy as np
 import pandas as pd
 import os
+import pathlib
 import re
 import sqlite3
 
+from concurrent.futures import ProcessPoolExecutor
+from etl import metrics, score_cache, store, tz
+
 config = {
     "timezone": "America/Toronto",
     "db_folder": "data",
     "db_folder_rx": r"^\d{4}-\d{2}-\d{2} \d{2}.\d{2}.\d{2}$",
     "frame_folder": "frames",
+    "frame_format": "parquet",
     "events_file": "card_events.pickle",
     "processed_file": "card_events_processed.pickle",
+    "workers": 1,
+    "score_cache_folder": "score_cache",
+    "score_cache_keep": 2,
+    "mmap_size": 2 ** 28,
+    "chunk_size": 65536,
+    "since_last_review": False,
 }
 
 
@@ -27,48 +42,151 @@ def concat_events(events1: pd.DataFrame, events2: pd.DataFrame) -> pd.DataFrame:
     return events
 
 
-def interpolate_row_events(group: pd.DataFrame) -> pd.DataFrame:
+def write_monthly_events(config, events: pd.DataFrame):
     """
-    Transform a single row of Pleco scores into a sequence of review events
+    Merge events into the partitions of the months they were reviewed in
     """
 
-    events = pd.DataFrame(columns=["reviewedtime", "result"])
+    months = events["reviewedtime"].values.astype("M8[M]")
+    existing = store.list_partitions(config, config["events_file"])
+    for month in np.unique(months):
+        partition = "month={}".format(np.datetime_as_string(month))
+        month_events = events[months == month]
+        if partition in existing:
+            month_events = concat_events(
+                store.read_partition(config, config["events_file"], partition),
+                month_events,
+            )
+        store.write_partition(config, config["events_file"], partition, month_events)
+
+
+def compact(config):
+    """
+    Merge the per-snapshot event partitions into monthly partitions
+    """
+
+    snapshots = [
+        p
+        for p in store.list_partitions(config, config["events_file"])
+        if p.startswith("snapshot=")
+    ]
+    if len(snapshots) == 0:
+        return
+
+    events = store.read_dataset(config, config["events_file"], snapshots)
+    write_monthly_events(config, events)
+    for partition in snapshots:
+        store.remove_partition(config, config["events_file"], partition)
 
-    row = group.iloc[0].copy()
-    reviewed = row["reviewed"]
 
-    if reviewed == 0:
-        return events
+def check_occurrences(last_scores: pd.DataFrame, incremental: pd.DataFrame):
+    """
+    Make sure new events start after the occurrences already saved for their
+    cards, which is all it takes for them not to collide with earlier partitions
+    """
 
-    firstreviewedtime = row["firstreviewedtime"]
-    lastreviewedtime = row["lastreviewedtime"]
-    history = str(row["history"])[::-1]
-    cumreviewed = row["cumreviewed"]
+    if last_scores is None:
+        return
 
-    duration = lastreviewedtime - firstreviewedtime
-    interval = duration / reviewed
-    for i in range(reviewed):
-        reviewed_time = firstreviewedtime + (interval * (i + 1))
-        result = int(history[i]) >= 4
-        events = events.append(
-            {"reviewedtime": reviewed_time, "result": result}, ignore_index=True
+    last_cumreviewed = last_scores["cumreviewed"].reindex(incremental.index)
+    first_occurrence = incremental["cumreviewed"].astype("i8") - incremental[
+        "reviewed"
+    ].astype("i8")
+    collisions = (incremental["reviewed"] > 0) & (first_occurrence < last_cumreviewed)
+    if collisions.any():
+        raise ValueError(
+            "Index has duplicate keys: {}".format(
+                list(incremental.index[collisions.values])
+            )
         )
 
-    events.index = events.index + (cumreviewed - reviewed)
-    events.index.name = "occurrence"
-    return events
+
+def divide_durations(duration: np.ndarray, reviewed: np.ndarray) -> np.ndarray:
+    """
+    Divide nanosecond durations by review counts, rounding exactly like
+    `pd.Timedelta / int` (true division, then truncation to whole nanoseconds)
+    """
+
+    quotient, remainder = np.divmod(duration, reviewed)
+    interval = np.trunc(quotient.astype("f8") + remainder / reviewed).astype("i8")
+
+    # Past 2**53 ns a float64 can't hold the quotient exactly, so defer to Python
+    wide = np.abs(quotient) >= 2 ** 53
+    if wide.any():
+        interval[wide] = [
+            int(int(d) / int(r)) for d, r in zip(duration[wide], reviewed[wide])
+        ]
+    return interval
+
+
+def decode_history_results(
+    history: pd.Series, reviewed: np.ndarray, rows: np.ndarray, step: np.ndarray
+) -> np.ndarray:
+    """
+    Decode the review results of every card's history string at once. Histories
+    are stored newest first, so step i of a card reads the i-th character from
+    the end of its history.
+    """
+
+    history = history.astype(str)
+    lengths = history.str.len().values.astype("i8")
+    if (lengths < reviewed).any():
+        raise ValueError("history is shorter than the number of reviews")
+
+    buffer = np.frombuffer("".join(history.values).encode("ascii"), dtype="u1")
+    ends = np.cumsum(lengths)
+    digits = buffer[ends[rows] - 1 - step] - ord("0")
+    return digits >= 4
 
 
 def interpolate_events(scores: pd.DataFrame) -> pd.DataFrame:
     """
     Given the scores or incremental scores, interpolate the sequence review events.
+
+    Each card's reviews are spread evenly between its first and last reviewed
+    times, with every card expanded in a single pass.
     """
 
     inc_scores = scores.query("reviewed > 0").copy()
     inc_scores.sort_index(inplace=True)
-    return inc_scores.groupby(["dictid", "dictentry", "hw", "created"]).apply(
-        interpolate_row_events
+
+    reviewed = inc_scores["reviewed"].values.astype("i8")
+    cumreviewed = inc_scores["cumreviewed"].values.astype("i8")
+
+    # One entry per review event: the card's row and its step within the card
+    rows = np.repeat(np.arange(len(inc_scores)), reviewed)
+    starts = np.cumsum(reviewed) - reviewed
+    step = np.arange(len(rows)) - starts[rows]
+
+    firstreviewedtime = inc_scores["firstreviewedtime"].values.astype("M8[ns]")
+    lastreviewedtime = inc_scores["lastreviewedtime"].values.astype("M8[ns]")
+    first = firstreviewedtime.view("i8")
+    interval = divide_durations(lastreviewedtime.view("i8") - first, reviewed)
+    reviewedtime = (first[rows] + interval[rows] * (step + 1)).view("M8[ns]")
+
+    result = decode_history_results(inc_scores["history"], reviewed, rows, step)
+
+    card_index = inc_scores.index.take(rows)
+    index = pd.MultiIndex.from_arrays(
+        [card_index.get_level_values(name) for name in card_index.names]
+        + [cumreviewed[rows] - reviewed[rows] + step],
+        names=card_index.names + ["occurrence"],
     )
+    return pd.DataFrame({"reviewedtime": reviewedtime, "result": result}, index=index)
+
+
+def slice_histories(history: pd.Series, lengths: np.ndarray) -> np.ndarray:
+    """
+    Take the first `lengths` characters of each history string. The histories are
+    encoded into a fixed-width uint8 array and everything past each length is
+    zeroed, which numpy drops when the rows are read back as strings.
+    """
+
+    encoded = history.values.astype("U").astype("S")
+    width = encoded.dtype.itemsize
+    codes = encoded.view("u1").reshape(len(encoded), width)
+    codes = np.where(np.arange(width) < lengths[:, np.newaxis], codes, 0)
+    return codes.astype("u1").view("S{}".format(width)).ravel().astype("U")
 
 
 def get_incremental_scores(
@@ -76,83 +194,129 @@ def get_incremental_scores(
 ) -> pd.DataFrame:
     """
     Gets the difference between two Pleco Databases
+
+    Cards that are new in scores2, or that were reset since scores1, have all of
+    their reviews counted as incremental. Their occurrences keep counting up from
+    the card's previous cumreviewed so they never collide with earlier events.
     """
 
     if scores1 is None:
         return scores2.copy()
 
-    diff = scores2.copy()
-    diff["inc_scores"] = (
-        (scores2["reviewed"] - scores1["reviewed"]).fillna(0).astype("u4")
+    last = scores1.reindex(scores2.index)
+
+    reviewed = scores2["reviewed"].values.astype("i8")
+    firstreviewedtime = scores2["firstreviewedtime"].values
+    last_frt = last["firstreviewedtime"].values
+    last_lrt = last["lastreviewedtime"].values
+
+    new = last["reviewed"].isna().values
+    last_reviewed = last["reviewed"].fillna(0).values.astype("i8")
+    last_cumreviewed = last["cumreviewed"].fillna(0).values.astype("i8")
+    reset = ~new & (
+        (reviewed < last_reviewed)
+        | (~np.isnat(last_frt) & (firstreviewedtime != last_frt))
     )
-    diff["inc_history"] = diff.apply(
-        lambda x: x["history"][: x["inc_scores"]] if x["inc_scores"] > 0 else np.nan,
-        axis=1,
+    restarted = new | reset
+
+    inc_scores = np.where(restarted, reviewed, reviewed - last_reviewed)
+    cumreviewed = np.where(new, scores2["cumreviewed"], last_cumreviewed + inc_scores)
+    inc_firstreviewedtime = np.where(
+        restarted, firstreviewedtime, np.fmax(firstreviewedtime, last_lrt)
     )
-    diff["last_frt"] = scores1["firstreviewedtime"]
-    diff["last_lrt"] = scores1["lastreviewedtime"]
-    diff["inc_firstreviewedtime"] = diff[["firstreviewedtime", "last_lrt"]].max(axis=1)
-
-    diff = diff[
-        [
-            "inc_firstreviewedtime",
-            "lastreviewedtime",
-            "inc_scores",
-            "cumreviewed",
-            "inc_history",
-        ]
-    ]
-    diff = diff.rename(
-        columns={
-            "inc_firstreviewedtime": "firstreviewedtime",
-            "inc_scores": "reviewed",
-            "inc_history": "history",
-        }
+
+    inc_history = pd.Series(np.nan, index=scores2.index, dtype=object)
+    changed = inc_scores > 0
+    if changed.any():
+        inc_history[changed] = slice_histories(
+            scores2["history"][changed], inc_scores[changed]
+        )
+
+    diff = pd.DataFrame(
+        {
+            "firstreviewedtime": inc_firstreviewedtime,
+            "lastreviewedtime": scores2["lastreviewedtime"].values,
+            "reviewed": inc_scores.astype("u4"),
+            "cumreviewed": cumreviewed.astype("u4"),
+            "history": inc_history.values,
+        },
+        index=scores2.index,
     )
     return diff
 
 
-def get_scores(db: sqlite3.Connection) -> pd.DataFrame:
+score_query = """
+SELECT c.dictid, c.dictentry, replace(c.hw, '@', ''), c.created,
+    s.firstreviewedtime, s.lastreviewedtime, s.reviewed, s.history
+FROM pleco_flash_cards AS c
+LEFT JOIN pleco_flash_scores_1 AS s ON s.card = c.id
+"""
+
+
+def connect(config, db_file: str) -> sqlite3.Connection:
     """
-    Gets the scores from a Pleco Database
+    Opens a Pleco Database read-only. A downloaded snapshot never changes, so it
+    is opened immutable, which skips locking, and read through a memory map.
     """
 
-    # Get & Format Cards
-    cards = pd.read_sql_query("SELECT * FROM pleco_flash_cards", db)
-    cards.rename(columns={"id": "card"}, inplace=True)
-    cards.set_index("card", inplace=True)
-    cards = cards[["dictid", "dictentry", "hw", "created"]]
-    cards["hw"] = cards["hw"].str.replace("@", "")
-    cards["created"] = (
-        pd.to_datetime(cards["created"], unit="s")
-        .dt.tz_localize("UTC")
-        .dt.tz_convert(config["timezone"])
-        .dt.tz_localize(None)
-    )
+    uri = pathlib.Path(db_file).resolve().as_uri() + "?mode=ro&immutable=1"
+    db = sqlite3.connect(uri, uri=True)
+    db.execute("PRAGMA mmap_size = {}".format(int(config["mmap_size"])))
+    return db
 
-    # Get & Format Scores
-    scores = pd.read_sql_query("SELECT * FROM pleco_flash_scores_1", db)
-    scores.set_index("card", inplace=True)
-    scores = scores[["firstreviewedtime", "lastreviewedtime", "reviewed", "history"]]
-    scores["firstreviewedtime"] = (
-        pd.to_datetime(scores["firstreviewedtime"], unit="s")
-        .dt.tz_localize("UTC")
-        .dt.tz_convert(config["timezone"])
-        .dt.tz_localize(None)
-    )
-    scores["lastreviewedtime"] = (
-        pd.to_datetime(scores["lastreviewedtime"], unit="s")
-        .dt.tz_localize("UTC")
-        .dt.tz_convert(config["timezone"])
-        .dt.tz_localize(None)
+
+def get_score_chunk(config, rows: list) -> dict:
+    """
+    Converts rows of the score query into typed arrays
+    """
+
+    columns = list(zip(*rows)) if len(rows) > 0 else [()] * 8
+    dictid, dictentry, hw, created, first, last, reviewed, history = columns
+    reviewed = np.array(reviewed, dtype="f8")
+    return {
+        "dictid": np.array(dictid, dtype="i8"),
+        "dictentry": np.array(dictentry, dtype="i8"),
+        "hw": np.array(hw, dtype=object),
+        "created": tz.from_epoch_seconds(created, config["timezone"]),
+        "firstreviewedtime": tz.from_epoch_seconds(first, config["timezone"]),
+        "lastreviewedtime": tz.from_epoch_seconds(last, config["timezone"]),
+        "reviewed": np.nan_to_num(reviewed).astype("u4"),
+        "history": np.array(history, dtype=object),
+    }
+
+
+def get_scores(config, db: sqlite3.Connection, since: int = None) -> pd.DataFrame:
+    """
+    Gets the scores from a Pleco Database, only of the cards last reviewed after
+    since (in epoch seconds) if given
+
+    Cards and scores are joined in SQLite and read in chunks, so only the
+    columns needed are ever held in Python objects.
+    """
+
+    query = score_query
+    params = []
+    if since is not None:
+        query += "WHERE s.lastreviewedtime > ?"
+        params.append(since)
+
+    cursor = db.execute(query, params)
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(config["chunk_size"])
+        if len(rows) == 0:
+            break
+        chunks.append(get_score_chunk(config, rows))
+
+    if len(chunks) == 0:
+        chunks.append(get_score_chunk(config, []))
+    scores = pd.DataFrame(
+        {c: np.concatenate([chunk[c] for chunk in chunks]) for c in chunks[0]}
     )
 
-    # Join Cards & Scores
-    scores = cards.join(scores, on="card")
     scores.set_index(
         ["dictid", "dictentry", "hw", "created"], inplace=True, verify_integrity=True
     )
-    scores["reviewed"] = scores["reviewed"].fillna(0).astype("u4")
     scores["cumreviewed"] = scores["reviewed"]
     scores = scores[
         ["firstreviewedtime", "lastreviewedtime", "reviewed", "cumreviewed", "history"]
@@ -162,30 +326,137 @@ def get_scores(db: sqlite3.Connection) -> pd.DataFrame:
     return scores
 
 
-def process(config):
+def merge_scores(last_scores: pd.DataFrame, scores: pd.DataFrame) -> pd.DataFrame:
+    """
+    Lays the scores of recently reviewed cards over the last snapshot's scores
+    """
+
+    unchanged = last_scores[~last_scores.index.isin(scores.index)]
+    return pd.concat([unchanged, scores]).sort_index()
+
+
+def get_since(last_scores: pd.DataFrame) -> int:
+    """
+    Gets the epoch seconds to read cards reviewed after, a day before the last
+    snapshot's latest review since its times are local
+    """
+
+    latest = last_scores["lastreviewedtime"].max()
+    if pd.isna(latest):
+        return None
+    return int(latest.value // 10 ** 9) - 24 * 60 * 60
+
+
+def restore_cumreviewed(config, scores: pd.DataFrame) -> pd.DataFrame:
+    """
+    Restores the running review counts of scores read from a Pleco Database,
+    where they restart at a reset card's reviewed count. Only the score cache
+    keeps them, so without it they are taken from the saved card events, the
+    last occurrence of each card being one less than its count.
+    """
+
+    events = store.read_dataset(config, config["events_file"], columns=[])
+    occurrence = events.index.get_level_values("occurrence")
+    saved = pd.Series(occurrence + 1, index=events.index.droplevel("occurrence"))
+    saved = saved.groupby(level=["dictid", "dictentry", "hw", "created"]).max()
+    saved = saved.reindex(scores.index).fillna(0).values
+
+    scores = scores.copy()
+    scores["cumreviewed"] = np.fmax(scores["reviewed"].values, saved).astype("u4")
+    return scores
+
+
+def get_fingerprint(db: sqlite3.Connection) -> str:
+    """
+    Gets a fingerprint of a Pleco Database's cards and scores from a few
+    aggregates. Backups from days without any study share the same fingerprint.
+    """
+
+    cards = db.execute("SELECT count(*), max(id) FROM pleco_flash_cards").fetchone()
+    scores = db.execute(
+        "SELECT count(*), sum(reviewed), max(lastreviewedtime) "
+        "FROM pleco_flash_scores_1"
+    ).fetchone()
+    return ":".join(str(x) for x in cards + scores)
+
+
+def load_fingerprint(config, db_file: str) -> str:
+    """
+    Gets the fingerprint of a Pleco Database file
+    """
+
+    with contextlib.closing(connect(config, db_file)) as db:
+        return get_fingerprint(db)
+
+
+def load_scores(config, db_file: str, since: int = None) -> pd.DataFrame:
     """
-    Process the files
+    Gets the scores from a Pleco Database file
+    """
+
+    with contextlib.closing(connect(config, db_file)) as db:
+        return get_scores(config, db, since)
+
+
+def iter_scores(config, db_files: list, since: int = None):
+    """
+    Yields the scores of each Pleco Database file in order. With more than one
+    worker the files are loaded in a process pool, keeping at most two loads per
+    worker in flight so finished snapshots don't pile up in memory.
+    """
+
+    load = functools.partial(load_scores, config, since=since)
+    workers = config.get("workers", 1)
+    if workers <= 1:
+        yield from map(load, db_files)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for db_file in db_files:
+            pending.append(executor.submit(load, db_file))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def process(config) -> list:
+    """
+    Process the files, returning the newly processed folders
     """
 
-    events_file = os.path.join(config["frame_folder"], config["events_file"])
-    processed_file = os.path.join(config["frame_folder"], config["processed_file"])
     db_folder_rx = re.compile(config["db_folder_rx"])
 
-    # Ensure we have a folder for persisting dataframes
-    if not os.path.exists(config["frame_folder"]):
-        os.mkdir(config["frame_folder"])
+    # Events saved as a single frame are split into monthly partitions once
+    if store.frame_exists(config, config["events_file"]):
+        write_monthly_events(config, store.read_frame(config, config["events_file"]))
+        store.remove_frame(config, config["events_file"])
 
-    # Load the record of processed Pleco Databases
-    if not os.path.exists(events_file):
-        processed = pd.DataFrame(columns=["folder", "starttime", "endtime"])
+    # Load the record of processed Pleco Databases. Snapshots without reviews
+    # write no partition, so the record alone says what has been processed.
+    if not store.frame_exists(config, config["processed_file"]):
+        processed = pd.DataFrame(
+            columns=["folder", "starttime", "endtime", "events", "fingerprint"]
+        )
     else:
-        processed = pd.read_pickle(processed_file)
+        processed = store.read_frame(config, config["processed_file"])
 
     # Get db folders
     db_folders = list(
         filter(lambda f: db_folder_rx.match(f), os.listdir(config["db_folder"]))
     )
 
+    # A folder still being downloaded only has a .part file
+    db_folders = list(
+        filter(
+            lambda f: os.path.exists(
+                os.path.join(config["db_folder"], f, "Pleco Flashcard Database.pqb")
+            ),
+            db_folders,
+        )
+    )
+
     # Get new db folders
     new_db_folders = list(
         filter(lambda f: f not in processed["folder"].values, db_folders)
@@ -193,46 +464,116 @@ def process(config):
     new_db_folders.sort()
 
     if len(new_db_folders) == 0:
-        return
+        return new_db_folders
 
-    # Load last scores
+    # Load last scores, preferring the cached copy over re-reading the database
     if len(processed) > 0:
+        last_folder = processed.iloc[-1]["folder"]
         db_file = os.path.join(
-            config["db_folder"],
-            processed.iloc[-1]["folder"],
-            "Pleco Flashcard Database.pqb",
+            config["db_folder"], last_folder, "Pleco Flashcard Database.pqb"
         )
-        with sqlite3.connect(db_file) as db:
-            last_scores = get_scores(db)
+        last_scores = score_cache.read_scores(config, last_folder, db_file)
+        if last_scores is None:
+            last_scores = restore_cumreviewed(config, load_scores(config, db_file))
+        last_fingerprint = processed.iloc[-1].get("fingerprint", None)
+        if pd.isna(last_fingerprint) and os.path.exists(db_file):
+            last_fingerprint = load_fingerprint(config, db_file)
     else:
         last_scores = None
+        last_fingerprint = None
 
-    # Get saved events
-    if os.path.exists(events_file):
-        events = pd.read_pickle(events_file)
-    else:
-        events = None
+    db_files = [
+        os.path.join(config["db_folder"], f, "Pleco Flashcard Database.pqb")
+        for f in new_db_folders
+    ]
+
+    # Snapshots unchanged since the one before them are recorded without loading
+    fingerprints = [load_fingerprint(config, db_file) for db_file in db_files]
+    unchanged = [
+        fingerprint == previous
+        for fingerprint, previous in zip(
+            fingerprints, [last_fingerprint] + fingerprints[:-1]
+        )
+    ]
 
-    for f in new_db_folders:
-        db_file = os.path.join(config["db_folder"], f, "Pleco Flashcard Database.pqb")
+    # Optionally only cards reviewed since the last snapshot are read, and laid
+    # over its scores
+    since = None
+    if config.get("since_last_review", False) and last_scores is not None:
+        since = get_since(last_scores)
+    snapshots = iter_scores(
+        config, [db_file for db_file, u in zip(db_files, unchanged) if not u], since
+    )
 
+    # Loading runs ahead in the pool; diffing against the last scores stays in order
+    processed_dbs = []
+    for f, fingerprint, u in zip(new_db_folders, fingerprints, unchanged):
         processed_db = {"folder": f, "starttime": pd.Timestamp.now(config["timezone"])}
-        with sqlite3.connect(db_file) as db:
-            scores = get_scores(db)
-        incremental = get_incremental_scores(last_scores, scores)
-        current_events = interpolate_events(incremental)
-        events = concat_events(events, current_events)
+        if u:
+            processed_db["endtime"] = processed_db["starttime"]
+            processed_db["events"] = 0
+            processed_db["fingerprint"] = fingerprint
+            processed_dbs.append(processed_db)
+            continue
+
+        # Loading isn't measured, as it may have run ahead in the pool
+        scores = next(snapshots)
+        with metrics.measure(config, "card_events/snapshot", snapshot=f) as record:
+            record["rows_in"] = len(scores.index)
+            incremental = get_incremental_scores(last_scores, scores)
+            current_events = interpolate_events(incremental)
+            check_occurrences(last_scores, incremental)
+            scores["cumreviewed"] = incremental["cumreviewed"]
+            if since is not None:
+                scores = merge_scores(last_scores, scores)
+            record["rows_out"] = len(current_events.index)
+
+            # Each snapshot only adds its own partition
+            if len(current_events.index) > 0:
+                store.write_partition(
+                    config, config["events_file"], "snapshot=" + f, current_events
+                )
 
         # Record processed db folder
         processed_db["endtime"] = pd.Timestamp.now(config["timezone"])
-        processed = processed.append(processed_db, ignore_index=True)
-        processed.reset_index(inplace=True, drop=True)
+        processed_db["events"] = len(current_events.index)
+        processed_db["fingerprint"] = fingerprint
+        processed_dbs.append(processed_db)
 
         last_scores = scores
 
-    events.to_pickle(events_file)
-    processed.to_pickle(processed_file)
+    # An empty record would leave its object columns' dtypes on the result
+    new_processed = pd.DataFrame(processed_dbs, columns=processed.columns)
+    processed = pd.concat(
+        [p for p in [processed, new_processed] if len(p.index) > 0], ignore_index=True
+    )
+    store.write_frame(config, config["processed_file"], processed)
+    score_cache.write_scores(config, new_db_folders[-1], db_files[-1], last_scores)
+    return new_db_folders
 
 
 if __name__ == "__main__":
-    process(config)
+    parser = argparse.ArgumentParser(description="Extract card review events")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=config["workers"],
+        help="processes used to load Pleco Databases in parallel",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="merge the per-snapshot event partitions into monthly partitions",
+    )
+    parser.add_argument(
+        "--since-last-review",
+        action="store_true",
+        help="only read the cards reviewed since the last processed snapshot",
+    )
+    args = parser.parse_args()
+    config["workers"] = args.workers
+    config["since_last_review"] = args.since_last_review
+    with metrics.measure(config, "card_events"):
+        process(config)
+    if args.compact:
+        compact(config)
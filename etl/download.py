@@ -1,61 +1,307 @@
 """
 Downloads all of the new Pleco databases
+
+Folders are downloaded in parallel, each worker over its own SFTP connection.
+A database is written to a .part file that later runs resume, and is only
+renamed into place once its size (and optionally its hash) matches the remote
+file, so a folder counts as downloaded only when its database is complete.
+
+With skip_identical, a database byte for byte the same as the one in the folder
+before it is copied from that folder locally instead of being transferred.
 """
 
+import argparse
+import hashlib
 import os
 import paramiko
+import posixpath
+import queue
 import re
+import shutil
+
+from concurrent.futures import ThreadPoolExecutor
 
 config = {
     "remote_host": "192.168.2.201",
+    "remote_port": 22,
     "remote_username": "pi",
+    "remote_key_file": None,
+    "known_hosts_file": None,
     "remote_folder": "/home/pi/PlecoDatabase",
     "local_folder": "data",
     "db_folder_rx": r"^\d{4}-\d{2}-\d{2} \d{2}.\d{2}.\d{2}$",
+    "db_file": "Pleco Flashcard Database.pqb",
+    "workers": 4,
+    "chunk_size": 1048576,
+    "verify_hash": False,
+    "recheck_sizes": False,
+    "skip_identical": False,
 }
 
 
-def process(config):
-    db_folder_rx = re.compile(config["db_folder_rx"])
+def connect(config) -> paramiko.SSHClient:
+    ssh_client = paramiko.SSHClient()
+    ssh_client.load_system_host_keys()
+    if config.get("known_hosts_file") is not None:
+        ssh_client.load_host_keys(config["known_hosts_file"])
+    ssh_client.connect(
+        config["remote_host"],
+        port=config.get("remote_port", 22),
+        username=config["remote_username"],
+        key_filename=config.get("remote_key_file"),
+    )
+    return ssh_client
+
+
+def get_remote_file(config, folder: str) -> str:
+    return posixpath.join(config["remote_folder"], folder, config["db_file"])
+
+
+def get_local_file(config, folder: str) -> str:
+    return os.path.join(config["local_folder"], folder, config["db_file"])
+
+
+def get_file_hash(path: str, chunk_size: int) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_remote_hashes(ssh_client: paramiko.SSHClient, remote_files: list) -> list:
+    """
+    Gets the SHA-256 of each remote file with a single command
+    """
 
-    # Get local folders
-    local_subfolders = list(
-        filter(lambda f: db_folder_rx.match(f), os.listdir(config["local_folder"]))
+    command = "sha256sum " + " ".join("'{}'".format(f) for f in remote_files)
+    _, stdout, _ = ssh_client.exec_command(command)
+    lines = stdout.read().decode("utf8").splitlines()
+    if len(lines) != len(remote_files):
+        raise IOError("sha256sum failed on {}".format(remote_files))
+    return [line.split(" ")[0] for line in lines]
+
+
+def get_remote_hash(ssh_client: paramiko.SSHClient, remote_file: str) -> str:
+    return get_remote_hashes(ssh_client, [remote_file])[0]
+
+
+def get_remote_folders(config, sftp_client: paramiko.SFTPClient) -> list:
+    db_folder_rx = re.compile(config["db_folder_rx"])
+    return sorted(
+        f for f in sftp_client.listdir(config["remote_folder"]) if db_folder_rx.match(f)
     )
 
-    # Connect to Remote
-    with paramiko.SSHClient() as ssh_client:
-        ssh_client.load_system_host_keys()
-        ssh_client.connect(config["remote_host"], username=config["remote_username"])
-
-        # Get remote folders
-        _, stdout, _ = ssh_client.exec_command("ls {}".format(config["remote_folder"]))
-        remote_subfolders = list(
-            filter(
-                lambda f: db_folder_rx.match(f),
-                map(lambda f: f.strip(), stdout.readlines()),
-            )
-        )
 
-        # Get new folders
-        new_subfolders = list(
-            filter(lambda f: f not in local_subfolders, remote_subfolders)
+def get_new_folders(
+    config, sftp_client: paramiko.SFTPClient, remote_folders: list
+) -> list:
+    """
+    Gets the remote folders whose database isn't complete locally
+    """
+
+    new_folders = []
+    for f in remote_folders:
+        local_file = get_local_file(config, f)
+        if not os.path.exists(local_file):
+            new_folders.append(f)
+        elif config.get("recheck_sizes", False):
+            # Catches databases cut short before downloads were verified
+            remote_size = sftp_client.stat(get_remote_file(config, f)).st_size
+            if os.path.getsize(local_file) != remote_size:
+                os.remove(local_file)
+                new_folders.append(f)
+    return new_folders
+
+
+def download_file(
+    config,
+    ssh_client: paramiko.SSHClient,
+    sftp_client: paramiko.SFTPClient,
+    remote_file: str,
+    local_file: str,
+):
+    """
+    Downloads a file through a .part file, resuming one left by an earlier run,
+    and renames it into place once verified
+    """
+
+    part_file = local_file + ".part"
+    remote_size = sftp_client.stat(remote_file).st_size
+    offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+    if offset > remote_size:
+        offset = 0
+
+    with sftp_client.open(remote_file, "rb") as remote:
+        remote.seek(offset)
+        # prefetch reads from the current position up to the offset given
+        remote.prefetch(remote_size)
+        with open(part_file, "ab" if offset > 0 else "wb") as local:
+            for chunk in iter(lambda: remote.read(config["chunk_size"]), b""):
+                local.write(chunk)
+
+    local_size = os.path.getsize(part_file)
+    if local_size != remote_size:
+        raise IOError(
+            "{} is {} bytes, expected {}".format(part_file, local_size, remote_size)
         )
+    if config.get("verify_hash", False):
+        local_hash = get_file_hash(part_file, config["chunk_size"])
+        if local_hash != get_remote_hash(ssh_client, remote_file):
+            # A resumed file that doesn't match is downloaded again from scratch
+            os.remove(part_file)
+            raise IOError("{} doesn't match {}".format(part_file, remote_file))
 
-        # Download new folders
+    os.replace(part_file, local_file)
+
+
+def get_identical_folders(
+    config, ssh_client: paramiko.SSHClient, remote_folders: list, new_folders: list
+) -> dict:
+    """
+    Maps each new folder whose database is the same as the previous folder's to
+    the earliest folder in that run of identical databases
+    """
+
+    if len(new_folders) == 0:
+        return {}
+
+    # The folder before the first new one may already be local
+    first = remote_folders.index(new_folders[0])
+    folders = remote_folders[max(0, first - 1) : first] + new_folders
+    hashes = get_remote_hashes(
+        ssh_client, [get_remote_file(config, f) for f in folders]
+    )
+
+    identical = {}
+    for previous, f, h, previous_hash in zip(
+        [None] + folders[:-1], folders, hashes, [None] + hashes[:-1]
+    ):
+        if h == previous_hash and f in new_folders:
+            identical[f] = identical.get(previous, previous)
+    return identical
+
+
+def copy_folder(config, source: str, f: str):
+    """
+    Copies an identical database from another local folder, hard linking it
+    where the filesystem allows
+    """
+
+    local_folder = os.path.join(config["local_folder"], f)
+    if not os.path.exists(local_folder):
+        os.mkdir(local_folder)
+    local_file = get_local_file(config, f)
+    part_file = local_file + ".part"
+    if os.path.exists(part_file):
+        os.remove(part_file)
+    try:
+        os.link(get_local_file(config, source), part_file)
+    except OSError:
+        shutil.copyfile(get_local_file(config, source), part_file)
+    os.replace(part_file, local_file)
+
+
+def download_folders(config, folders: queue.Queue) -> list:
+    """
+    Downloads folders from the queue over one connection until it is empty
+    """
+
+    downloaded = []
+    with connect(config) as ssh_client:
         with ssh_client.open_sftp() as sftp_client:
-            for f in new_subfolders:
-                local_subfolder = os.path.join(config["local_folder"], f)
-                if not os.path.exists(local_subfolder):
-                    os.mkdir(local_subfolder)
-                local_file = os.path.join(
-                    local_subfolder, "Pleco Flashcard Database.pqb"
-                )
-                remote_file = "/{}/{}/Pleco Flashcard Database.pqb".format(
-                    config["remote_folder"], f
+            while True:
+                try:
+                    f = folders.get_nowait()
+                except queue.Empty:
+                    return downloaded
+
+                local_folder = os.path.join(config["local_folder"], f)
+                if not os.path.exists(local_folder):
+                    os.mkdir(local_folder)
+                download_file(
+                    config,
+                    ssh_client,
+                    sftp_client,
+                    get_remote_file(config, f),
+                    get_local_file(config, f),
                 )
-                sftp_client.get(remote_file, local_file)
+                print("Downloaded {}".format(f))
+                downloaded.append(f)
+
+
+def process(config) -> list:
+    """
+    Downloads the new folders, returning the ones downloaded
+    """
+
+    with connect(config) as ssh_client:
+        with ssh_client.open_sftp() as sftp_client:
+            remote_folders = get_remote_folders(config, sftp_client)
+            new_folders = get_new_folders(config, sftp_client, remote_folders)
+        identical = {}
+        if config.get("skip_identical", False):
+            identical = get_identical_folders(
+                config, ssh_client, remote_folders, new_folders
+            )
+    if len(new_folders) == 0:
+        return []
+
+    folders = queue.Queue()
+    for f in new_folders:
+        if f not in identical:
+            folders.put(f)
+
+    downloaded = []
+    workers = max(1, min(config.get("workers", 1), folders.qsize()))
+    if folders.qsize() > 0:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(download_folders, config, folders)
+                for _ in range(workers)
+            ]
+            for future in futures:
+                downloaded.extend(future.result())
+
+    # Sources are either downloaded above or were already local
+    for f, source in identical.items():
+        copy_folder(config, source, f)
+        print("Copied {} from {}".format(f, source))
+        downloaded.append(f)
+    return sorted(downloaded)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download new Pleco Databases")
+    parser.add_argument("--host", default=config["remote_host"])
+    parser.add_argument("--port", type=int, default=config["remote_port"])
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=config["workers"],
+        help="folders downloaded in parallel, each over its own connection",
+    )
+    parser.add_argument(
+        "--verify-hash",
+        action="store_true",
+        help="compare each database's SHA-256 with the remote copy",
+    )
+    parser.add_argument(
+        "--recheck-sizes",
+        action="store_true",
+        help="download again any local database whose size differs from the remote",
+    )
+    parser.add_argument(
+        "--skip-identical",
+        action="store_true",
+        help="copy a database unchanged since the previous folder instead of "
+        "transferring it",
+    )
+    args = parser.parse_args()
+    config["remote_host"] = args.host
+    config["remote_port"] = args.port
+    config["workers"] = args.workers
+    config["verify_hash"] = args.verify_hash
+    config["recheck_sizes"] = args.recheck_sizes
+    config["skip_identical"] = args.skip_identical
     process(config)
@@ -1,18 +1,33 @@
+import argparse
 import os
+import numpy as np
 import pandas as pd
 
+from etl import metrics, schema, store
+
 config = {
     "frame_folder": "frames",
+    "frame_format": "parquet",
     "card_events_file": "card_events.pickle",
+    "card_events_processed_file": "card_events_processed.pickle",
     "hw_events_file": "hw_events.pickle",
+    "hw_events_state_file": "hw_events_state.pickle",
+    "hw_events_changes_file": "hw_events_changes.pickle",
+    "hw_codes_file": "hw_codes.pickle",
+    "hw_events_spill_file": "hw_events_spill.pickle",
+    "incremental": True,
+    "verify": False,
+    "memory_limit": None,
 }
 
+# Peak bytes held per event while a bucket is read, sorted and numbered
+event_bytes = 160
 
-def process(config):
-    card_events_file = os.path.join(config["frame_folder"], config["card_events_file"])
 
-    card_events = pd.read_pickle(card_events_file)
-    card_events.reset_index()
+def get_hw_events(card_events: pd.DataFrame) -> pd.DataFrame:
+    """
+    Orders every headword's review events and numbers their occurrences
+    """
 
     hw_events = (
         card_events.reset_index()[["hw", "reviewedtime", "result"]]
@@ -23,10 +38,326 @@ def process(config):
     hw_events.set_index(
         ["hw", "occurrence"], drop=True, inplace=True, verify_integrity=True
     )
+    return hw_events
+
+
+def merge_hw_events(hw_events: pd.DataFrame, card_events: pd.DataFrame):
+    """
+    Adds new card events to the headword events, renumbering only the headwords
+    they touch. Returns the merged events and, for each changed headword, the
+    first occurrence that changed.
+    """
+
+    new_events = card_events.reset_index()[["hw", "reviewedtime", "result"]]
+    new_events["new"] = True
+
+    changed = hw_events.index.get_level_values("hw").isin(new_events["hw"].unique())
+    old_events = hw_events[changed].reset_index()[["hw", "reviewedtime", "result"]]
+    old_events["new"] = False
+
+    events = (
+        pd.concat([old_events, new_events])
+        .sort_values(by=["hw", "reviewedtime", "result"])
+        .reset_index(drop=True)
+    )
+    events["occurrence"] = events.groupby(["hw"]).cumcount()
+    changes = events[events["new"]].groupby(["hw"], observed=True)["occurrence"].min()
+
+    events = events[["hw", "occurrence", "reviewedtime", "result"]]
+    events.set_index(["hw", "occurrence"], inplace=True, verify_integrity=True)
+    merged = pd.concat([hw_events[~changed], events])
+    merged.sort_index(inplace=True)
+    return merged, changes
+
+
+def read_card_events(
+    config, partitions: list = None, columns: list = None
+) -> pd.DataFrame:
+    """
+    Reads the card events (their times and results by default) with their
+    headwords coded, adding new headwords to the saved codes
+    """
+
+    card_events = store.read_dataset(
+        config,
+        config["card_events_file"],
+        partitions,
+        columns=columns or ["reviewedtime", "result"],
+    )
+    hws = card_events.index.levels[card_events.index.names.index("hw")]
+    return schema.conform(card_events, "card_events", schema.get_hw_dtype(config, hws))
+
+
+def get_new_partitions(config, processed: pd.DataFrame, mark: str):
+    """
+    Gets the card event partitions of the snapshots processed after the mark, or
+    None if any of them has already been compacted into a monthly partition
+    """
+
+    partitions = set(store.list_partitions(config, config["card_events_file"]))
+    new_partitions = []
+    for _, row in processed[processed["folder"] > mark].iterrows():
+        partition = "snapshot=" + row["folder"]
+        if partition in partitions:
+            new_partitions.append(partition)
+        elif row.get("events", None) != 0:
+            return None
+    return new_partitions
+
+
+def get_progress(config) -> tuple:
+    """
+    Gets the last snapshot folder in the card events, and the card event
+    partitions the headword events haven't merged yet (None when they need a
+    rebuild)
+    """
+
+    processed = store.read_frame(config, config["card_events_processed_file"])
+    mark = processed["folder"].max() if len(processed.index) > 0 else None
+
+    # Pick up from the last snapshot already merged into the headword events
+    new_partitions = None
+    if (
+        config.get("incremental", False)
+        and store.frame_exists(config, config["hw_events_state_file"])
+        and store.frame_exists(config, config["hw_events_file"])
+    ):
+        state = store.read_frame(config, config["hw_events_state_file"])
+        new_partitions = get_new_partitions(config, processed, state["folder"].iloc[0])
+    return mark, new_partitions
+
+
+def count_hw_events(config, partitions: list) -> np.ndarray:
+    """
+    Counts the card events of each headword code, a partition at a time. New
+    headwords are coded all at once, as a rebuild in memory would.
+    """
+
+    counts = []
+    for partition in partitions:
+        card_events = store.read_partition(
+            config, config["card_events_file"], partition, columns=["result"]
+        )
+        hws = card_events.index.get_level_values("hw").astype(object)
+        counts.append(hws.value_counts())
+    counts = pd.concat(counts).groupby(level=0).sum()
+    hw_dtype = schema.get_hw_dtype(config, counts.index)
+    return counts.reindex(hw_dtype.categories, fill_value=0).values
+
+
+def get_buckets(counts: np.ndarray, bucket_events: int) -> np.ndarray:
+    """
+    Assigns each headword code to a bucket of consecutive codes holding about
+    bucket_events events. A headword with more events gets a bucket to itself.
+    """
+
+    starts = np.cumsum(counts) - counts
+    _, buckets = np.unique(starts // bucket_events, return_inverse=True)
+    return buckets
+
+
+def spill_card_events(
+    config, partitions: list, buckets: np.ndarray, bucket_events: int
+):
+    """
+    Splits the card events by headword bucket into the spill dataset, gathering
+    partitions until they hold about a bucket's worth of events so each bucket
+    isn't spilled in lots of small pieces
+    """
+
+    spill_file = config["hw_events_spill_file"]
+    pending = []
+    pending_events = 0
+    spilled = 0
+    for i, partition in enumerate(partitions):
+        card_events = read_card_events(config, [partition])
+        pending.append(card_events.reset_index()[["hw", "reviewedtime", "result"]])
+        pending_events += len(card_events.index)
+        if pending_events < bucket_events and i < len(partitions) - 1:
+            continue
+
+        events = pd.concat(pending, ignore_index=True)
+        for bucket, spill in events.groupby(buckets[events["hw"].cat.codes]):
+            store.write_partition(
+                config,
+                spill_file,
+                "bucket={:05d}-{:05d}".format(bucket, spilled),
+                spill.reset_index(drop=True),
+            )
+        pending = []
+        pending_events = 0
+        spilled += 1
 
-    hw_events_file = os.path.join(config["frame_folder"], config["hw_events_file"])
-    hw_events.to_pickle(hw_events_file)
+
+def remove_spill(config):
+    spill_file = config["hw_events_spill_file"]
+    for partition in store.list_partitions(config, spill_file):
+        store.remove_partition(config, spill_file, partition)
+    spill_folder = store.get_dataset_folder(config, spill_file)
+    if os.path.exists(spill_folder):
+        os.rmdir(spill_folder)
+
+
+def iter_bucket_hw_events(config, hw_dtype: pd.CategoricalDtype):
+    """
+    Yields the headword events of each spilled bucket, in headword code order
+    """
+
+    spill_file = config["hw_events_spill_file"]
+    partitions = store.list_partitions(config, spill_file)
+    buckets = sorted(set(p.split("-")[0] for p in partitions))
+    for bucket in buckets:
+        bucket_partitions = [p for p in partitions if p.startswith(bucket + "-")]
+        events = store.read_dataset(config, spill_file, bucket_partitions)
+        yield get_hw_events(schema.conform(events, "hw_events", hw_dtype))
+
+
+def write_hw_events_by_bucket(config) -> int:
+    """
+    Rebuilds the headword events a bucket of headwords at a time, so only about
+    memory_limit bytes of events are sorted at once. Buckets hold consecutive
+    headword codes, so they come out in index order and are appended straight to
+    the saved frame. Returns the number of events written.
+    """
+
+    partitions = store.list_partitions(config, config["card_events_file"])
+    counts = count_hw_events(config, partitions)
+    bucket_events = max(1, config["memory_limit"] // event_bytes)
+    buckets = get_buckets(counts, bucket_events)
+
+    # Anything left by an interrupted build would be read twice
+    remove_spill(config)
+    spill_card_events(config, partitions, buckets, bucket_events)
+    try:
+        store.write_frame_chunks(
+            config,
+            config["hw_events_file"],
+            iter_bucket_hw_events(config, schema.get_hw_dtype(config)),
+        )
+    finally:
+        remove_spill(config)
+    return int(counts.sum())
+
+
+def build_in_buckets(config) -> bool:
+    """
+    Runs a due rebuild a bucket of headwords at a time when a memory limit is
+    set, saving the headword events as it goes. Returns whether it did, leaving
+    incremental merges, and rebuilds without any card events, to build.
+    """
+
+    if config.get("memory_limit") is None:
+        return False
+    if len(store.list_partitions(config, config["card_events_file"])) == 0:
+        return False
+    mark, new_partitions = get_progress(config)
+    if new_partitions is not None:
+        return False
+
+    with metrics.measure(config, "hw_events/rebuild_in_buckets") as r:
+        r["rows_out"] = write_hw_events_by_bucket(config)
+
+    if config.get("verify", False):
+        pd.testing.assert_frame_equal(
+            schema.read_frame(config, config["hw_events_file"]),
+            get_hw_events(read_card_events(config)),
+            check_dtype=False,
+        )
+
+    # The stats stage rebuilds everything from the saved headword events
+    store.remove_frame(config, config["hw_events_changes_file"])
+    save(config, None, None, mark)
+    return True
+
+
+def build(config):
+    """
+    Brings the headword events up to date with the saved card events. Returns the
+    headword events (None when nothing is new), the changes the stats stage still
+    has to apply (None when it has to rebuild everything) and the last snapshot
+    folder included.
+    """
+
+    mark, new_partitions = get_progress(config)
+
+    # Changes not yet applied by the stats stage, if it isn't due a full rebuild
+    if store.frame_exists(config, config["hw_events_changes_file"]):
+        pending = store.read_frame(config, config["hw_events_changes_file"])
+        pending = pending["occurrence"]
+    else:
+        pending = None
+
+    if new_partitions is None:
+        card_events = read_card_events(config)
+        with metrics.measure(config, "hw_events/rebuild", len(card_events.index)) as r:
+            hw_events = get_hw_events(card_events)
+            r["rows_out"] = len(hw_events.index)
+        changes = None
+    elif len(new_partitions) > 0:
+        card_events = read_card_events(config, new_partitions)
+        hw_events = schema.read_frame(config, config["hw_events_file"])
+        with metrics.measure(config, "hw_events/merge", len(card_events.index)) as r:
+            hw_events, changes = merge_hw_events(hw_events, card_events)
+            r["rows_out"] = len(hw_events.index)
+
+        # Keep the earliest change of each headword until the stats stage uses it
+        if pending is not None:
+            changes = pd.concat([pending, changes]).groupby(level=0).min()
+        else:
+            changes = None
+    else:
+        hw_events = None
+        changes = pending
+
+    if config.get("verify", False) and hw_events is not None:
+        pd.testing.assert_frame_equal(
+            hw_events, get_hw_events(read_card_events(config)), check_dtype=False
+        )
+
+    return hw_events, changes, mark
+
+
+def save(config, hw_events: pd.DataFrame, changes: pd.Series, mark: str):
+    if hw_events is not None:
+        store.write_frame(config, config["hw_events_file"], hw_events)
+
+        # Without a record of changes, the stats stage rebuilds everything
+        if changes is None:
+            store.remove_frame(config, config["hw_events_changes_file"])
+        else:
+            store.write_frame(
+                config, config["hw_events_changes_file"], changes.to_frame()
+            )
+    if mark is not None:
+        state = pd.DataFrame({"folder": [mark]})
+        store.write_frame(config, config["hw_events_state_file"], state)
+
+
+def process(config):
+    if not build_in_buckets(config):
+        save(config, *build(config))
 
 
 if __name__ == "__main__":
-    process(config)
+    parser = argparse.ArgumentParser(description="Build headword review events")
+    parser.add_argument(
+        "--full", action="store_true", help="rebuild instead of adding new events"
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="check the result against a full rebuild",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=int,
+        metavar="MB",
+        help="rebuild in buckets of headwords sorted within this much memory",
+    )
+    args = parser.parse_args()
+    config["incremental"] = not args.full
+    config["verify"] = args.verify
+    if args.memory_limit is not None:
+        config["memory_limit"] = args.memory_limit * 2 ** 20
+    with metrics.measure(config, "hw_events"):
+        process(config)
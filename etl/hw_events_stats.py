@@ -1,70 +1,227 @@
-import os
+import argparse
+import numpy as np
 import pandas as pd
 
+from etl import metrics, rollups, schema, store
+
 config = {
     "frame_folder": "frames",
+    "frame_format": "parquet",
     "hw_events_file": "hw_events.pickle",
     "hw_events_stats_file": "hw_events_stats.pickle",
+    "hw_events_changes_file": "hw_events_changes.pickle",
+    "hw_events_daily_file": "hw_events_daily.pickle",
+    "hw_events_weekly_file": "hw_events_weekly.pickle",
+    "hw_events_hw_weekly_file": "hw_events_hw_weekly.pickle",
+    "hw_codes_file": "hw_codes.pickle",
+    "etl_version_file": "etl_version.json",
+    "incremental": True,
+    "verify": False,
 }
 
 
-def is_learned(row):
-    return row["daycorrect"] > 0 and row["dayincorrect"] == 0
+def is_learned(daycorrect: pd.Series, dayincorrect: pd.Series) -> pd.Series:
+    return (daycorrect > 0) & (dayincorrect == 0)
 
 
-def get_net_learned(row):
-    if not pd.isna(row["laglearned"]) and row["learned"] == row["laglearned"]:
-        return 0
-    if pd.isna(row["laglearned"]) and not row["learned"]:
-        return 0
-    if row["learned"]:
-        return 1
-    return -1
+def get_net_learned(learned: pd.Series, laglearned: pd.Series) -> np.ndarray:
+    """
+    1 when a headword becomes learned, -1 when it is forgotten, 0 otherwise. A
+    headword's first day only counts when it is learned.
+    """
 
+    learned = learned.values.astype(bool)
+    lag_missing = pd.isna(laglearned).values
+    lag = laglearned.fillna(False).values.astype(bool)
+    unchanged = ~lag_missing & (lag == learned)
+    never_learned = lag_missing & ~learned
+    return np.select([unchanged, never_learned, learned], [0, 0, 1], default=-1)
 
-def process(config):
 
-    hw_events_file = os.path.join(config["frame_folder"], config["hw_events_file"])
-    hw_events = pd.read_pickle(hw_events_file)
+def get_stats(hw_events: pd.DataFrame) -> pd.DataFrame:
+    """
+    Computes the running and daily stats of every headword review event
+    """
 
     hw_events_stats = hw_events.copy()
 
-    hw_events_stats["invresult"] = hw_events_stats["result"].apply(lambda x: not x)
-    hw_events_stats["revieweddate"] = hw_events_stats["reviewedtime"].apply(
-        lambda x: x.date()
-    )
+    result = hw_events_stats["result"].astype(bool)
+    hw_events_stats["invresult"] = ~result
+    hw_events_stats["revieweddate"] = hw_events_stats["reviewedtime"].dt.normalize()
+
+    correct = result.astype("u4")
+    incorrect = 1 - correct
     hw_events_stats["cumcorrect"] = (
-        hw_events_stats.groupby(["hw"])["result"]
-        .apply(lambda x: x.cumsum())
-        .astype("u2")
+        correct.groupby(level="hw", observed=True).cumsum().astype("u2")
     )
     hw_events_stats["cumincorrect"] = (
-        hw_events_stats.groupby(["hw"])["result"]
-        .apply(lambda x: x.apply(lambda y: not y).cumsum())
-        .astype("u2")
+        incorrect.groupby(level="hw", observed=True).cumsum().astype("u2")
     )
+
+    # Group days by the reviewed time truncated to midnight, same as revieweddate
+    hws = hw_events_stats.index.get_level_values("hw")
+    days = hw_events_stats["reviewedtime"].values.astype("M8[D]")
     hw_events_stats["daycorrect"] = (
-        hw_events_stats.groupby(["hw", "revieweddate"])["result"]
-        .transform("sum")
-        .astype("u2")
+        correct.groupby([hws, days], observed=True).transform("sum").astype("u2")
     )
     hw_events_stats["dayincorrect"] = (
-        hw_events_stats.groupby(["hw", "revieweddate"])["invresult"]
-        .transform("sum")
-        .astype("u2")
+        incorrect.groupby([hws, days], observed=True).transform("sum").astype("u2")
     )
-    hw_events_stats["learned"] = hw_events_stats.apply(is_learned, axis=1)
-    hw_events_stats["laglearned"] = hw_events_stats.groupby(["hw"], as_index=False)[
-        "learned"
-    ].shift(1)
-    hw_events_stats["netlearned"] = hw_events_stats.apply(get_net_learned, axis=1)
-
-    hw_events_stats_file = os.path.join(
-        config["frame_folder"], config["hw_events_stats_file"]
+    hw_events_stats["learned"] = is_learned(
+        hw_events_stats["daycorrect"], hw_events_stats["dayincorrect"]
+    )
+    hw_events_stats["laglearned"] = hw_events_stats.groupby(
+        ["hw"], as_index=False, observed=True
+    )["learned"].shift(1)
+    hw_events_stats["netlearned"] = get_net_learned(
+        hw_events_stats["learned"], hw_events_stats["laglearned"]
     )
-    hw_events_stats.to_pickle(hw_events_stats_file)
 
+    return schema.conform(hw_events_stats, "hw_events_stats")
 
-if __name__ == "__main__":
-    process(config)
 
+def get_incremental_stats(
+    hw_events: pd.DataFrame, stats: pd.DataFrame, changes: pd.Series
+) -> pd.DataFrame:
+    """
+    Recomputes the stats of changed headwords from the start of the day of their
+    first changed occurrence, seeded from the last stored event before that day
+    """
+
+    if len(changes.index) == 0:
+        return stats
+
+    events = hw_events[hw_events.index.get_level_values("hw").isin(changes.index)]
+    events = events.reset_index()
+    events["revieweddate"] = events["reviewedtime"].dt.normalize()
+
+    # The day of each headword's first change is recomputed in full
+    first_changed = events.merge(changes.to_frame("changed"), on="hw")
+    first_changed = first_changed[
+        first_changed["occurrence"] == first_changed["changed"]
+    ].set_index("hw")["revieweddate"]
+    events["firstchangeddate"] = first_changed.reindex(events["hw"]).values
+    tail = events[events["revieweddate"] >= events["firstchangeddate"]]
+    cuts = tail.groupby(["hw"], observed=True)["occurrence"].min()
+
+    tail = tail.set_index(["hw", "occurrence"])[hw_events.columns]
+    tail_stats = get_stats(tail)
+
+    # Seed the running totals from the last event kept for each headword
+    seed_index = pd.MultiIndex.from_arrays(
+        [cuts.index, cuts.values - 1], names=["hw", "occurrence"]
+    )
+    seeds = stats.reindex(seed_index)[["cumcorrect", "cumincorrect", "learned"]]
+    seeds.index = cuts.index
+
+    tail_hws = tail_stats.index.get_level_values("hw")
+    for column in ["cumcorrect", "cumincorrect"]:
+        seed = seeds[column].reindex(tail_hws).fillna(0).values
+        tail_stats[column] = (tail_stats[column].values + seed).astype("u2")
+
+    first_rows = ~tail_hws.duplicated()
+    laglearned = tail_stats["laglearned"].copy()
+    laglearned[first_rows] = seeds["learned"].reindex(tail_hws[first_rows]).values
+    tail_stats["laglearned"] = laglearned
+    tail_stats["netlearned"] = get_net_learned(
+        tail_stats["learned"], tail_stats["laglearned"]
+    )
+
+    kept = cuts.reindex(stats.index.get_level_values("hw"))
+    kept = kept.fillna(len(stats.index)).values
+    kept = stats[stats.index.get_level_values("occurrence") < kept]
+    hw_events_stats = pd.concat([kept, tail_stats])
+    hw_events_stats.sort_index(inplace=True)
+    return hw_events_stats
+
+
+def build(config, hw_events: pd.DataFrame, changes: pd.Series = None):
+    """
+    Brings the stats and their rollups up to date with the headword events. Only
+    the changed headwords are recomputed, unless changes is None or there are no
+    saved stats.
+    """
+
+    if (
+        config.get("incremental", False)
+        and changes is not None
+        and store.frame_exists(config, config["hw_events_stats_file"])
+    ):
+        stats = schema.read_frame(config, config["hw_events_stats_file"])
+        with metrics.measure(config, "hw_events_stats/update", len(changes)) as r:
+            hw_events_stats = get_incremental_stats(hw_events, stats, changes)
+            r["rows_out"] = len(hw_events_stats.index)
+        with metrics.measure(config, "hw_events_stats/rollups", len(changes)):
+            hw_events_rollups = rollups.update_rollups(
+                config, stats, hw_events_stats, changes.index
+            )
+    else:
+        with metrics.measure(
+            config, "hw_events_stats/rebuild", len(hw_events.index)
+        ) as r:
+            hw_events_stats = get_stats(hw_events)
+            r["rows_out"] = len(hw_events_stats.index)
+        with metrics.measure(config, "hw_events_stats/rollups", len(hw_events.index)):
+            hw_events_rollups = rollups.get_rollups(hw_events_stats)
+
+    if config.get("verify", False):
+        pd.testing.assert_frame_equal(
+            hw_events_stats, get_stats(hw_events), check_dtype=False
+        )
+        for name, rollup in rollups.get_rollups(hw_events_stats).items():
+            pd.testing.assert_frame_equal(
+                hw_events_rollups[name], rollup, check_dtype=False
+            )
+
+    return hw_events_stats, hw_events_rollups
+
+
+def save(config, hw_events_stats: pd.DataFrame, hw_events_rollups: dict = None):
+    store.write_frame(
+        config, config["hw_events_stats_file"], hw_events_stats, sort_by="revieweddate"
+    )
+    if hw_events_rollups is None:
+        hw_events_rollups = rollups.get_rollups(hw_events_stats)
+    rollups.write_rollups(config, hw_events_rollups)
+
+    # Every recorded change has now been applied
+    no_changes = pd.DataFrame(
+        {"occurrence": pd.Series([], dtype="i8")}, index=pd.Index([], name="hw")
+    )
+    store.write_frame(config, config["hw_events_changes_file"], no_changes)
+
+    # Reports cached from the previous stats are stale from here on
+    store.write_version(config)
+
+
+def read_changes(config) -> pd.Series:
+    """
+    Gets the changes the headword stage recorded since the stats were last built,
+    or None if the stats need a full rebuild
+    """
+
+    if not store.frame_exists(config, config["hw_events_changes_file"]):
+        return None
+    return store.read_frame(config, config["hw_events_changes_file"])["occurrence"]
+
+
+def process(config):
+    hw_events = schema.read_frame(config, config["hw_events_file"])
+    save(config, *build(config, hw_events, read_changes(config)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build headword review stats")
+    parser.add_argument(
+        "--full", action="store_true", help="rebuild instead of updating changes"
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="check the result against a full rebuild",
+    )
+    args = parser.parse_args()
+    config["incremental"] = not args.full
+    config["verify"] = args.verify
+    with metrics.measure(config, "hw_events_stats"):
+        process(config)
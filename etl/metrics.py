@@ -0,0 +1,243 @@
+"""
+Records how long each stage takes and how much memory it uses
+
+measure() wraps a stage, and measured() a report function, appending a JSON
+line to the metrics file with its wall time, CPU time, peak RSS and rows in
+and out. Reports are called from notebooks and served from the report cache
+too, so they are only measured when their config sets measure_reports, as the
+pipeline does. Running this module summarizes the latest run against earlier
+ones.
+"""
+
+import argparse
+import contextlib
+import datetime
+import functools
+import json
+import os
+import pandas as pd
+import time
+
+from etl import schema
+
+config = {
+    "frame_folder": "frames",
+    "metrics_file": "metrics.jsonl",
+    "baseline_runs": 5,
+    "threshold": 1.25,
+    "measure_reports": False,
+}
+
+run_id = "{:%Y-%m-%dT%H:%M:%S}-{}".format(datetime.datetime.now(), os.getpid())
+
+# Records of the stages being measured, innermost last
+active = []
+
+
+def get_metrics_path(config) -> str:
+    return os.path.join(
+        config["frame_folder"], config.get("metrics_file", "metrics.jsonl")
+    )
+
+
+def reset_peak_rss():
+    """
+    Starts the peak RSS over from the current RSS, where Linux allows it
+    """
+
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def read_peak_rss() -> int:
+    """
+    Gets the peak RSS since the last reset, or since the process started where
+    it can't be reset
+    """
+
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return schema.get_peak_rss()
+
+
+def get_cpu_times() -> tuple:
+    """
+    Gets the CPU time of the process and of its finished child processes
+    """
+
+    times = os.times()
+    return times.user + times.system, times.children_user + times.children_system
+
+
+def write_record(config, record: dict):
+    path = get_metrics_path(config)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+@contextlib.contextmanager
+def measure(config, stage: str, rows_in: int = None, **tags):
+    """
+    Measures the block as a stage. The record is yielded so the block can set
+    rows_in and rows_out once it knows them.
+    """
+
+    record = dict(tags, run=run_id, stage=stage, rows_in=rows_in, rows_out=None)
+    record["start"] = datetime.datetime.now().isoformat()
+    reset_peak_rss()
+    active.append(record)
+    wall = time.perf_counter()
+    cpu, children_cpu = get_cpu_times()
+    try:
+        yield record
+    finally:
+        end_cpu, end_children_cpu = get_cpu_times()
+        record["wall"] = time.perf_counter() - wall
+        record["cpu"] = end_cpu - cpu
+        record["children_cpu"] = end_children_cpu - children_cpu
+
+        # Inner stages reset the peak, so it is carried out to the stages around them
+        peak_rss = read_peak_rss()
+        record["peak_rss"] = max(peak_rss or 0, record.pop("inner_peak_rss", 0))
+        active.pop()
+        if len(active) > 0:
+            outer_peak_rss = active[-1].get("inner_peak_rss", 0)
+            active[-1]["inner_peak_rss"] = max(outer_peak_rss, record["peak_rss"])
+        write_record(config, record)
+
+
+def measured(stage: str):
+    """
+    Measures each call of a function that takes config first, counting the rows
+    of the frame it returns, if the config sets measure_reports
+    """
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(config, *args, **kwargs):
+            if not config.get("measure_reports", False):
+                return fn(config, *args, **kwargs)
+            with measure(config, stage) as record:
+                result = fn(config, *args, **kwargs)
+                if isinstance(result, pd.DataFrame):
+                    record["rows_out"] = len(result.index)
+                return result
+
+        return wrapper
+
+    return decorate
+
+
+def read_metrics(config) -> pd.DataFrame:
+    path = get_metrics_path(config)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=["run", "stage", "start", "wall", "cpu"])
+    with open(path, "r") as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def get_run_totals(metrics: pd.DataFrame) -> pd.DataFrame:
+    """
+    Totals each stage within each run, one row per (run, stage) in run order
+    """
+
+    metrics = metrics.copy()
+    for column in ["rows_in", "rows_out", "children_cpu", "peak_rss"]:
+        if column not in metrics.columns:
+            metrics[column] = None
+    totals = metrics.groupby(["run", "stage"]).agg(
+        start=("start", "min"),
+        calls=("wall", "size"),
+        wall=("wall", "sum"),
+        cpu=("cpu", "sum"),
+        children_cpu=("children_cpu", "sum"),
+        peak_rss=("peak_rss", "max"),
+        rows_in=("rows_in", "sum"),
+        rows_out=("rows_out", "sum"),
+    )
+    return totals.reset_index().sort_values(by=["start", "stage"])
+
+
+def summarize(config, metrics: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compares each stage of the latest run with its median over the runs before,
+    flagging the stages whose wall time or peak RSS grew past the threshold
+    """
+
+    totals = get_run_totals(metrics)
+    runs = totals.groupby("run")["start"].min().sort_values().index
+    latest = totals[totals["run"] == runs[-1]].set_index("stage")
+    earlier = totals[totals["run"].isin(runs[-config["baseline_runs"] - 1 : -1])]
+    baseline = earlier.groupby("stage")[["wall", "cpu", "peak_rss"]].median()
+
+    summary = latest[["calls", "rows_in", "rows_out", "wall", "cpu", "peak_rss"]]
+    summary = summary.join(baseline, rsuffix="_baseline")
+    summary["wall_ratio"] = summary["wall"] / summary["wall_baseline"]
+    summary["peak_rss_ratio"] = summary["peak_rss"] / summary["peak_rss_baseline"]
+    summary["regression"] = (summary["wall_ratio"] > config["threshold"]) | (
+        summary["peak_rss_ratio"] > config["threshold"]
+    )
+    return summary
+
+
+def process(config):
+    metrics = read_metrics(config)
+    if len(metrics.index) == 0:
+        print("No metrics recorded in {}".format(get_metrics_path(config)))
+        return
+
+    summary = summarize(config, metrics)
+    summary["peak_rss"] = summary["peak_rss"] / 2 ** 20
+    summary["peak_rss_baseline"] = summary["peak_rss_baseline"] / 2 ** 20
+    columns = [
+        "calls",
+        "rows_out",
+        "wall",
+        "wall_baseline",
+        "wall_ratio",
+        "cpu",
+        "peak_rss",
+        "peak_rss_ratio",
+        "regression",
+    ]
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(summary[columns].round(3))
+    regressions = summary.index[summary["regression"]]
+    if len(regressions) > 0:
+        print("Regressed: {}".format(", ".join(regressions)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Summarize the latest run's stage metrics against earlier runs"
+    )
+    parser.add_argument("--frame-folder", default=config["frame_folder"])
+    parser.add_argument("--metrics-file", default=config["metrics_file"])
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=config["baseline_runs"],
+        help="earlier runs the latest is compared with",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=config["threshold"],
+        help="ratio to the earlier runs' median past which a stage has regressed",
+    )
+    args = parser.parse_args()
+    config["frame_folder"] = args.frame_folder
+    config["metrics_file"] = args.metrics_file
+    config["baseline_runs"] = args.runs
+    config["threshold"] = args.threshold
+    process(config)
@@ -0,0 +1,270 @@
+"""
+Runs the ETL stages and reports in one process
+
+Frames are handed from stage to stage in memory, only the checkpoints named in
+config["checkpoints"] are saved, and a stage is skipped when nothing upstream
+ran and the files it reads are unchanged since its last run.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pandas as pd
+
+from etl import (
+    card_events,
+    hw_events,
+    hw_events_stats,
+    metrics,
+    retention,
+    schema,
+    store,
+)
+
+config = {
+    "frame_folder": "frames",
+    "frame_format": "parquet",
+    "db_folder": "data",
+    "state_file": "pipeline_state.json",
+    "checkpoints": ["hw_events", "hw_events_stats"],
+    "download": False,
+    "reports": True,
+    "measure_reports": True,
+}
+
+checkpoints = ["hw_events", "hw_events_stats"]
+
+
+def get_fingerprint(paths: list) -> str:
+    """
+    Hashes the names, sizes and modification times of the files under the paths
+    """
+
+    entries = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(r, f) for r, _, fs in os.walk(path) for f in fs]
+        elif os.path.exists(path):
+            files = [path]
+        else:
+            files = []
+        for file_path in files:
+            stat = os.stat(file_path)
+            entries.append([file_path, stat.st_size, stat.st_mtime_ns])
+    entries.sort()
+    return hashlib.sha1(json.dumps(entries).encode("utf8")).hexdigest()
+
+
+def get_frame_inputs(config, *names) -> list:
+    paths = []
+    for name in names:
+        paths.append(store.get_dataset_folder(config, name))
+        for frame_format in store.extensions:
+            paths.append(store.get_frame_path(config, name, frame_format))
+    return paths
+
+
+def run_download(config, frames):
+    from etl import download
+
+    downloaded = download.process(
+        dict(download.config, local_folder=config["db_folder"])
+    )
+    return len(downloaded) > 0
+
+
+def run_card_events(config, frames):
+    stage_config = dict(card_events.config, **config)
+    return len(card_events.process(stage_config)) > 0
+
+
+def run_hw_events(config, frames):
+    stage_config = dict(hw_events.config, **config)
+    # A rebuild in buckets saves the events itself, for the stats stage to read
+    if hw_events.build_in_buckets(stage_config):
+        return True
+    events, changes, mark = hw_events.build(stage_config)
+    if events is None:
+        return False
+
+    if "hw_events" in config["checkpoints"]:
+        hw_events.save(stage_config, events, changes, mark)
+    frames["hw_events"] = events
+    frames["hw_events_changes"] = changes
+    return True
+
+
+def run_hw_events_stats(config, frames):
+    stage_config = dict(hw_events_stats.config, **config)
+    if "hw_events" in frames:
+        events = frames["hw_events"]
+        changes = frames["hw_events_changes"]
+    else:
+        events = schema.read_frame(stage_config, stage_config["hw_events_file"])
+        changes = hw_events_stats.read_changes(stage_config)
+
+    stats, rollups = hw_events_stats.build(stage_config, events, changes)
+    if "hw_events_stats" in config["checkpoints"]:
+        hw_events_stats.save(stage_config, stats, rollups)
+    frames["hw_events_stats"] = stats
+    return True
+
+
+def run_retention(config, frames):
+    stage_config = dict(retention.config, **config)
+    if "hw_events" in frames:
+        events = frames["hw_events"]
+    else:
+        events = schema.read_frame(stage_config, stage_config["hw_events_file"])
+
+    retention.save(stage_config, *retention.build(stage_config, events))
+    return True
+
+
+def run_reports(config, frames):
+    from all_time import config as all_time_config, plot_all_time_report
+
+    plot_all_time_report(
+        dict(all_time_config, **config), hw_stats=frames.get("hw_events_stats")
+    )
+    return True
+
+
+def get_stages(config) -> list:
+    """
+    Gets the stages in dependency order: (name, dependencies, inputs, run)
+    """
+
+    stages = []
+    if config["download"]:
+        stages.append(("download", [], None, run_download))
+    stages.append(
+        (
+            "card_events",
+            [s[0] for s in stages],
+            [config["db_folder"]],
+            run_card_events,
+        )
+    )
+    stages.append(
+        (
+            "hw_events",
+            ["card_events"],
+            get_frame_inputs(
+                config,
+                card_events.config["events_file"],
+                card_events.config["processed_file"],
+            ),
+            run_hw_events,
+        )
+    )
+    stages.append(
+        (
+            "hw_events_stats",
+            ["hw_events"],
+            get_frame_inputs(config, hw_events.config["hw_events_file"]),
+            run_hw_events_stats,
+        )
+    )
+    stages.append(
+        (
+            "retention",
+            ["hw_events"],
+            get_frame_inputs(config, hw_events.config["hw_events_file"]),
+            run_retention,
+        )
+    )
+    if config["reports"]:
+        stages.append(
+            (
+                "reports",
+                ["hw_events_stats"],
+                get_frame_inputs(
+                    config,
+                    hw_events_stats.config["hw_events_stats_file"],
+                    hw_events_stats.config["hw_events_daily_file"],
+                    hw_events_stats.config["hw_events_weekly_file"],
+                    hw_events_stats.config["hw_events_hw_weekly_file"],
+                ),
+                run_reports,
+            )
+        )
+    return stages
+
+
+def process(config):
+    state_file = os.path.join(config["frame_folder"], config["state_file"])
+    if os.path.exists(state_file):
+        with open(state_file, "r") as f:
+            state = json.load(f)
+    else:
+        state = {}
+
+    frames = {}
+    ran = set()
+    for name, dependencies, inputs, run in get_stages(config):
+        fingerprint = get_fingerprint(inputs) if inputs is not None else None
+        upstream_ran = any(d in ran for d in dependencies)
+        if (
+            not upstream_ran
+            and fingerprint is not None
+            and state.get(name) == fingerprint
+        ):
+            print("Skipping {}, its inputs are unchanged".format(name))
+            continue
+
+        print("Running {}".format(name))
+        with metrics.measure(config, name) as record:
+            if run(config, frames):
+                ran.add(name)
+            if isinstance(frames.get(name), pd.DataFrame):
+                record["rows_out"] = len(frames[name].index)
+        schema.report_memory(name, frames)
+
+        # Record what the stage saw, so an unchanged rerun can skip it. A stage
+        # whose output wasn't saved has to run again next time.
+        saved = name not in checkpoints or name in config["checkpoints"]
+        if inputs is not None and saved:
+            state[name] = get_fingerprint(inputs)
+        if not os.path.exists(config["frame_folder"]):
+            os.mkdir(config["frame_folder"])
+        with open(state_file, "w") as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the ETL stages and reports")
+    parser.add_argument(
+        "--download", action="store_true", help="download new Pleco Databases first"
+    )
+    parser.add_argument(
+        "--no-reports", action="store_true", help="stop after the ETL stages"
+    )
+    parser.add_argument(
+        "--checkpoints",
+        nargs="*",
+        default=config["checkpoints"],
+        choices=checkpoints,
+        help="intermediate frames to save",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=card_events.config["workers"],
+        help="processes used to load Pleco Databases in parallel",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=int,
+        metavar="MB",
+        help="rebuild headword events in buckets sorted within this much memory",
+    )
+    args = parser.parse_args()
+    config["download"] = args.download
+    config["reports"] = not args.no_reports
+    config["checkpoints"] = args.checkpoints
+    config["workers"] = args.workers
+    if args.memory_limit is not None:
+        config["memory_limit"] = args.memory_limit * 2 ** 20
+    process(config)
@@ -0,0 +1,311 @@
+"""
+Fits a forgetting curve to every headword's review history
+
+A headword is taken to be recalled with probability 2 ** (-lag / halflife), where
+lag is the days since its previous review and each headword has a half-life of
+its own. The half-lives are fitted to the results of every review but the first,
+for all headwords at once, by Newton steps on the log of the decay rate. Each
+estimate is pulled towards the half-life fitted to all headwords together, so a
+headword never forgotten (or never recalled) still gets a finite half-life.
+
+Later runs only refit the headwords with new events, against the prior saved by
+the last full fit. The prior is left as it was, so those fits drift from what a
+full fit would give as reviews come in; once the reviews have grown by
+prior_refit_growth since the prior was fitted, the prior and every headword are
+refitted.
+"""
+
+import argparse
+import functools
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+from etl import metrics, schema, store
+
+config = {
+    "frame_folder": "frames",
+    "frame_format": "parquet",
+    "hw_events_file": "hw_events.pickle",
+    "hw_retention_file": "hw_retention.pickle",
+    "hw_retention_state_file": "hw_retention_state.pickle",
+    "hw_codes_file": "hw_codes.pickle",
+    "etl_version_file": "etl_version.json",
+    "min_lag_hours": 1,
+    "prior_scale": 1.0,
+    "iterations": 50,
+    "prior_refit_growth": 0.25,
+    "workers": 1,
+    "incremental": True,
+    "verify": False,
+}
+
+day = np.timedelta64(1, "D")
+
+# Newton stops once no log rate moves more than this
+tolerance = 1e-8
+
+
+def get_reviews(hw_events: pd.DataFrame, min_lag_hours: float) -> tuple:
+    """
+    Gets the headword code, days since the previous review and result of every
+    review but each headword's first. Reviews closer together than min_lag_hours
+    say little about forgetting and are left out.
+    """
+
+    codes = hw_events.index.get_level_values("hw").codes
+    times = hw_events["reviewedtime"].values
+    results = hw_events["result"].values.astype(bool)
+
+    lags = (times[1:] - times[:-1]) / day
+    repeat = (codes[1:] == codes[:-1]) & (lags * 24 >= min_lag_hours)
+    return codes[1:][repeat], lags[repeat], results[1:][repeat]
+
+
+def fit_log_rates(
+    codes: np.ndarray,
+    lags: np.ndarray,
+    results: np.ndarray,
+    n: int,
+    prior: float,
+    prior_scale: float,
+    iterations: int,
+) -> np.ndarray:
+    """
+    Fits the log decay rate (per day) of each of n codes, with a normal prior of
+    the given mean and scale. The log likelihood is concave in the log rate, so
+    every code's Newton steps are taken together.
+    """
+
+    log_rates = np.full(n, prior)
+    for _ in range(iterations):
+        x = np.exp(log_rates[codes]) * lags
+
+        # A recall adds -x to the gradient and Hessian. A lapse adds
+        # x / (e^x - 1), and x (e^x - 1 - x e^x) / (e^x - 1)^2, which vanish by
+        # x = 50, before e^x overflows.
+        lapse_x = np.minimum(x, 50)
+        expm1 = np.expm1(lapse_x)
+        lapse_gradient = lapse_x / expm1
+        lapse_hessian = lapse_x * (expm1 - lapse_x * (expm1 + 1)) / expm1 ** 2
+
+        gradient = (
+            np.bincount(codes, np.where(results, -x, lapse_gradient), minlength=n)
+            - (log_rates - prior) / prior_scale ** 2
+        )
+        hessian = (
+            np.bincount(codes, np.where(results, -x, lapse_hessian), minlength=n)
+            - 1 / prior_scale ** 2
+        )
+        step = np.clip(gradient / hessian, -1, 1)
+        log_rates -= step
+        if len(step) == 0 or np.abs(step).max() < tolerance:
+            break
+    return log_rates
+
+
+def fit_half_lives(
+    config, codes: np.ndarray, lags: np.ndarray, results: np.ndarray, n: int, prior
+) -> np.ndarray:
+    """
+    Fits the half-life in days of each of n headword codes. With more than one
+    worker, ranges of codes are fitted in a process pool. Codes must be in order.
+    """
+
+    fit = functools.partial(
+        fit_log_rates,
+        prior=prior,
+        prior_scale=config["prior_scale"],
+        iterations=config["iterations"],
+    )
+    workers = config.get("workers", 1)
+    if workers <= 1:
+        log_rates = fit(codes, lags, results, n)
+    else:
+        bounds = np.linspace(0, n, workers + 1).astype(int)
+        splits = np.searchsorted(codes, bounds)
+        shards = list(zip(bounds[:-1], bounds[1:], splits[:-1], splits[1:]))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            log_rates = np.concatenate(
+                list(
+                    executor.map(
+                        fit,
+                        [codes[s:e] - lo for lo, _, s, e in shards],
+                        [lags[s:e] for _, _, s, e in shards],
+                        [results[s:e] for _, _, s, e in shards],
+                        [hi - lo for lo, hi, _, _ in shards],
+                    )
+                )
+            )
+    return np.log(2) / np.exp(log_rates)
+
+
+def fit_prior(config, lags: np.ndarray, results: np.ndarray) -> float:
+    """
+    Fits one log decay rate to every headword's reviews, starting from a day's
+    half-life
+    """
+
+    codes = np.zeros(len(lags), dtype="i8")
+    log_rates = fit_log_rates(
+        codes, lags, results, 1, np.log(np.log(2)), 1e3, config["iterations"]
+    )
+    return log_rates[0]
+
+
+def get_summaries(hw_events: pd.DataFrame) -> pd.DataFrame:
+    """
+    Gets each headword's number of reviews and last review time
+    """
+
+    summaries = hw_events.groupby(level="hw", observed=True)["reviewedtime"].agg(
+        ["count", "max"]
+    )
+    summaries.columns = ["reviews", "lastreviewed"]
+    return summaries
+
+
+def get_retention(
+    config, hw_events: pd.DataFrame, summaries: pd.DataFrame, prior: float
+) -> pd.DataFrame:
+    """
+    Fits the half-lives of the headwords summarized, from their events
+    """
+
+    hws = hw_events.index.get_level_values("hw")
+    events = hw_events[hws.isin(summaries.index)]
+    codes, lags, results = get_reviews(events, config["min_lag_hours"])
+    n = len(hws.categories)
+    half_lives = fit_half_lives(config, codes, lags, results, n, prior)
+
+    retention = summaries.copy()
+    retention["halflife"] = half_lives[retention.index.codes]
+    return schema.conform(retention, "hw_retention")
+
+
+def read_state(config, reviews: int) -> pd.DataFrame:
+    """
+    Gets the prior saved by the last full fit, or None if there is none or the
+    reviews have grown too much since for it to still stand
+    """
+
+    for name in [config["hw_retention_file"], config["hw_retention_state_file"]]:
+        if not store.frame_exists(config, name):
+            return None
+
+    state = store.read_frame(config, config["hw_retention_state_file"])
+    fitted_reviews = state["reviews"].iloc[0] if "reviews" in state.columns else 0
+    if reviews > fitted_reviews * (1 + config.get("prior_refit_growth", 0.25)):
+        print(
+            "Refitting the prior and every headword, as reviews grew from {:,} to "
+            "{:,} since the last full fit".format(fitted_reviews, reviews)
+        )
+        return None
+    return state
+
+
+def build(config, hw_events: pd.DataFrame) -> tuple:
+    """
+    Brings the headword half-lives up to date with the headword events. Only the
+    headwords whose reviews changed are refitted, unless there are no saved
+    half-lives or the prior has gone stale. Returns them with the prior log
+    decay rate they were fitted to and the number of reviews it was fitted on.
+    """
+
+    summaries = get_summaries(hw_events)
+    reviews = int(summaries["reviews"].sum())
+    state = read_state(config, reviews) if config.get("incremental", False) else None
+    if state is not None:
+        retention = schema.read_frame(config, config["hw_retention_file"])
+        prior = np.log(np.log(2) / state["halflife"].iloc[0])
+        prior_reviews = int(state["reviews"].iloc[0])
+
+        saved = retention[["reviews", "lastreviewed"]].reindex(summaries.index)
+        changed = (saved != summaries).any(axis=1).values
+        with metrics.measure(config, "retention/update", int(changed.sum())) as r:
+            refitted = get_retention(config, hw_events, summaries[changed], prior)
+            retention = pd.concat(
+                [retention.reindex(summaries.index[~changed]), refitted]
+            )
+            retention.sort_index(inplace=True)
+            r["rows_out"] = len(refitted.index)
+    else:
+        with metrics.measure(config, "retention/rebuild", len(summaries.index)) as r:
+            _, lags, results = get_reviews(hw_events, config["min_lag_hours"])
+            prior = fit_prior(config, lags, results)
+            prior_reviews = reviews
+            retention = get_retention(config, hw_events, summaries, prior)
+            r["rows_out"] = len(retention.index)
+
+    if config.get("verify", False):
+        pd.testing.assert_frame_equal(
+            retention,
+            get_retention(config, hw_events, summaries, prior),
+            check_dtype=False,
+            rtol=1e-6,
+        )
+
+    return retention, prior, prior_reviews
+
+
+def save(config, retention: pd.DataFrame, prior: float, prior_reviews: int):
+    store.write_frame(config, config["hw_retention_file"], retention)
+    state = pd.DataFrame(
+        {"halflife": [np.log(2) / np.exp(prior)], "reviews": [prior_reviews]}
+    )
+    store.write_frame(config, config["hw_retention_state_file"], state)
+
+    # Cached headword reports show the old predictions from here on
+    store.write_version(config)
+
+
+def get_recall(config, hws: pd.Index, now: pd.Timestamp = None) -> pd.DataFrame:
+    """
+    Gets the half-life of each headword and the chance it is recalled now, or
+    NaN for headwords without a fitted half-life
+    """
+
+    recall = pd.DataFrame(
+        {"halflife": np.nan, "recall": np.nan}, index=pd.Index(hws, name="hw")
+    )
+    if not store.frame_exists(config, config["hw_retention_file"]):
+        return recall
+
+    retention = store.read_frame(config, config["hw_retention_file"])
+    retention.index = retention.index.astype(object)
+    retention = retention.reindex(recall.index)
+
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    lag = ((now - retention["lastreviewed"]) / day).clip(lower=0)
+    recall["halflife"] = retention["halflife"]
+    recall["recall"] = np.exp2(-lag / retention["halflife"])
+    return recall
+
+
+def process(config):
+    hw_events = schema.read_frame(config, config["hw_events_file"])
+    save(config, *build(config, hw_events))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit headword forgetting curves")
+    parser.add_argument(
+        "--full", action="store_true", help="refit every headword and the prior"
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="check the result against refitting every headword",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=config["workers"],
+        help="processes fitting ranges of headwords in parallel",
+    )
+    args = parser.parse_args()
+    config["incremental"] = not args.full
+    config["verify"] = args.verify
+    config["workers"] = args.workers
+    with metrics.measure(config, "retention"):
+        process(config)
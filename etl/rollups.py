@@ -0,0 +1,204 @@
+"""
+Builds the rollups the reports read instead of the per-event stats
+
+hw_events_daily and hw_events_weekly hold the review totals of each day and ISO
+week. hw_events_hw_weekly summarizes each headword's reviews in each week, in a
+form that combines over consecutive weeks into the stats_by_hw report.
+"""
+
+import numpy as np
+import pandas as pd
+
+from etl import schema, store
+
+config = {
+    "frame_folder": "frames",
+    "frame_format": "parquet",
+    "hw_events_daily_file": "hw_events_daily.pickle",
+    "hw_events_weekly_file": "hw_events_weekly.pickle",
+    "hw_events_hw_weekly_file": "hw_events_hw_weekly.pickle",
+}
+
+rollup_files = [
+    "hw_events_daily_file",
+    "hw_events_weekly_file",
+    "hw_events_hw_weekly_file",
+]
+
+totals = ["reviewed", "new", "learned", "forgot", "netlearned"]
+
+
+def get_weeks(dates) -> np.ndarray:
+    """
+    Gets the Monday starting the ISO week of each date
+    """
+
+    days = np.asarray(dates, dtype="M8[D]")
+    # Day 0 of the epoch was a Thursday
+    weekdays = (days.astype("i8") + 3) % 7
+    return (days - weekdays).astype("M8[ns]")
+
+
+def get_week_start(date, later: bool = False) -> pd.Timestamp:
+    """
+    Gets the Monday of the date's week, or the next Monday if later is set and
+    the date isn't a Monday
+    """
+
+    date = pd.Timestamp(date).normalize()
+    week = date - pd.Timedelta(days=date.weekday())
+    if later and week < date:
+        week += pd.Timedelta(days=7)
+    return week
+
+
+def get_daily_stats(hw_events_stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Totals the review events of each day, one row per revieweddate
+    """
+
+    occurrence = hw_events_stats.index.get_level_values("occurrence").values
+    netlearned = hw_events_stats["netlearned"].values.astype("i8")
+    events = pd.DataFrame(
+        {
+            "reviewed": np.ones(len(netlearned), dtype="i8"),
+            "new": (occurrence == 0).astype("i8"),
+            "learned": (netlearned == 1).astype("i8"),
+            "forgot": (netlearned == -1).astype("i8"),
+            "netlearned": netlearned,
+        }
+    )
+    daily = events.groupby(hw_events_stats["revieweddate"].values).sum()
+    daily.index.name = "revieweddate"
+    return schema.conform(daily.reset_index(), "hw_events_daily")
+
+
+def get_weekly_stats(daily: pd.DataFrame) -> pd.DataFrame:
+    """
+    Totals the daily totals of each ISO week, one row per week
+    """
+
+    weekly = daily.groupby(get_weeks(daily["revieweddate"]))[totals].sum()
+    weekly.index.name = "week"
+    return schema.conform(weekly.reset_index(), "hw_events_weekly")
+
+
+def get_hw_summaries(hw_events_stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarizes each headword's reviews in each week, one row per (hw, week)
+    """
+
+    stats = hw_events_stats.reset_index()
+    stats["week"] = get_weeks(stats["revieweddate"])
+    stats["correct"] = stats["result"].astype(bool)
+    stats["incorrect"] = stats["invresult"].astype(bool)
+    stats["new"] = stats["occurrence"] == 0
+    # first skips missing values, so laglearned is turned into a flag first
+    stats["knew"] = stats["laglearned"].fillna(False).astype(bool)
+
+    # Rows are in review order within each headword, so first and last are the
+    # first and last reviews of the week
+    summaries = stats.groupby(["hw", "week"], observed=True).agg(
+        reviewed=("occurrence", "size"),
+        firstreviewed=("revieweddate", "first"),
+        lastreviewed=("revieweddate", "last"),
+        correct=("correct", "sum"),
+        incorrect=("incorrect", "sum"),
+        new=("new", "first"),
+        knew=("knew", "first"),
+    )
+    changes = stats[stats["netlearned"] != 0].groupby(["hw", "week"], observed=True)
+    summaries["firstchange"] = (
+        changes["netlearned"].first().reindex(summaries.index, fill_value=0)
+    )
+    return schema.conform(summaries.reset_index(), "hw_events_hw_weekly")
+
+
+def combine_hw_summaries(summaries: pd.DataFrame) -> pd.DataFrame:
+    """
+    Combines (hw, week) summaries into one summary per headword over all the
+    weeks given
+    """
+
+    summaries = summaries.sort_values(by=["hw", "week"], kind="mergesort")
+    combined = summaries.groupby(["hw"], observed=True).agg(
+        reviewed=("reviewed", "sum"),
+        firstreviewed=("firstreviewed", "first"),
+        lastreviewed=("lastreviewed", "last"),
+        correct=("correct", "sum"),
+        incorrect=("incorrect", "sum"),
+        new=("new", "first"),
+        knew=("knew", "first"),
+    )
+    changes = summaries[summaries["firstchange"] != 0]
+    changes = changes.groupby(["hw"], observed=True)["firstchange"].first()
+    combined["firstchange"] = changes.reindex(combined.index, fill_value=0)
+    return combined
+
+
+def get_rollups(hw_events_stats: pd.DataFrame) -> dict:
+    """
+    Builds every rollup from the stats, keyed by config file key
+    """
+
+    daily = get_daily_stats(hw_events_stats)
+    return {
+        "hw_events_daily_file": daily,
+        "hw_events_weekly_file": get_weekly_stats(daily),
+        "hw_events_hw_weekly_file": get_hw_summaries(hw_events_stats),
+    }
+
+
+def update_rollups(
+    config, old_stats: pd.DataFrame, hw_events_stats: pd.DataFrame, hws: pd.Index
+) -> dict:
+    """
+    Brings the saved rollups up to date with stats where only the headwords in
+    hws changed since old_stats. Daily totals take the difference of the changed
+    headwords' rows; their weekly summaries are rebuilt.
+    """
+
+    if not all(store.frame_exists(config, config[f]) for f in rollup_files):
+        return get_rollups(hw_events_stats)
+    if len(hws) == 0:
+        return {f: schema.read_frame(config, config[f]) for f in rollup_files}
+
+    old_rows = old_stats[old_stats.index.get_level_values("hw").isin(hws)]
+    new_rows = hw_events_stats[hw_events_stats.index.get_level_values("hw").isin(hws)]
+
+    daily = schema.read_frame(config, config["hw_events_daily_file"])
+    daily = (
+        daily.set_index("revieweddate")
+        .sub(get_daily_stats(old_rows).set_index("revieweddate"), fill_value=0)
+        .add(get_daily_stats(new_rows).set_index("revieweddate"), fill_value=0)
+        .astype("i8")
+    )
+    daily = daily[daily["reviewed"] > 0].sort_index().reset_index()
+    daily = schema.conform(daily, "hw_events_daily")
+
+    hw_weekly = schema.read_frame(config, config["hw_events_hw_weekly_file"])
+    hw_weekly = pd.concat(
+        [hw_weekly[~hw_weekly["hw"].isin(hws)], get_hw_summaries(new_rows)]
+    )
+    hw_weekly = hw_weekly.sort_values(by=["hw", "week"]).reset_index(drop=True)
+
+    return {
+        "hw_events_daily_file": daily,
+        "hw_events_weekly_file": get_weekly_stats(daily),
+        "hw_events_hw_weekly_file": hw_weekly,
+    }
+
+
+def write_rollups(config, rollups: dict):
+    store.write_frame(
+        config, config["hw_events_daily_file"], rollups["hw_events_daily_file"]
+    )
+    store.write_frame(
+        config, config["hw_events_weekly_file"], rollups["hw_events_weekly_file"]
+    )
+    store.write_frame(
+        config,
+        config["hw_events_hw_weekly_file"],
+        rollups["hw_events_hw_weekly_file"],
+        sort_by="week",
+    )
@@ -0,0 +1,200 @@
+"""
+Keeps the event frames in compact dtypes
+
+Headwords are categorical, with codes taken from a saved dictionary that only
+ever grows, so every frame built or read in a run shares the same categories.
+Dates are datetime64, flags are bool (or nullable boolean where a headword has
+no previous day) and counters use the smallest integer type that fits.
+"""
+
+import os
+import pandas as pd
+import sys
+
+from etl import store
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+config = {
+    "frame_folder": "frames",
+    "frame_format": "parquet",
+    "hw_codes_file": "hw_codes.pickle",
+}
+
+totals = {
+    "reviewed": "i4",
+    "new": "i4",
+    "learned": "i4",
+    "forgot": "i4",
+    "netlearned": "i4",
+}
+
+schemas = {
+    "card_events": {"reviewedtime": "M8[ns]", "result": "bool"},
+    "hw_events": {"reviewedtime": "M8[ns]", "result": "bool"},
+    "hw_events_stats": {
+        "reviewedtime": "M8[ns]",
+        "result": "bool",
+        "invresult": "bool",
+        "revieweddate": "M8[ns]",
+        "cumcorrect": "u2",
+        "cumincorrect": "u2",
+        "daycorrect": "u2",
+        "dayincorrect": "u2",
+        "learned": "bool",
+        "laglearned": "boolean",
+        "netlearned": "i1",
+    },
+    "hw_events_daily": dict(totals, revieweddate="M8[ns]"),
+    "hw_events_weekly": dict(totals, week="M8[ns]"),
+    "hw_events_hw_weekly": {
+        "week": "M8[ns]",
+        "reviewed": "u2",
+        "firstreviewed": "M8[ns]",
+        "lastreviewed": "M8[ns]",
+        "correct": "u2",
+        "incorrect": "u2",
+        "new": "bool",
+        "knew": "bool",
+        "firstchange": "i1",
+    },
+    "hw_retention": {"reviews": "u4", "lastreviewed": "M8[ns]", "halflife": "f8"},
+}
+
+
+# Index levels of the frames read back from partitioned datasets
+indexes = {
+    "card_events": {
+        "dictid": "i8",
+        "dictentry": "i8",
+        "hw": "object",
+        "created": "M8[ns]",
+        "occurrence": "i8",
+    },
+}
+
+
+def get_schema_name(name: str) -> str:
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def get_empty_frame(name: str, columns: list = None) -> pd.DataFrame:
+    """
+    Gets a frame of the named schema without any rows
+    """
+
+    schema = schemas[get_schema_name(name)]
+    index = pd.MultiIndex.from_arrays(
+        [pd.Index([], dtype=t) for t in indexes[get_schema_name(name)].values()],
+        names=list(indexes[get_schema_name(name)]),
+    )
+    return pd.DataFrame(
+        {c: pd.Series([], dtype=t) for c, t in schema.items()}, index=index
+    )[columns if columns is not None else list(schema)]
+
+
+def get_hw_dtype(config, hws=None) -> pd.CategoricalDtype:
+    """
+    Gets the headword categories, adding any of hws not seen before to the end
+    of the saved dictionary
+    """
+
+    if store.frame_exists(config, config["hw_codes_file"]):
+        codes = store.read_frame(config, config["hw_codes_file"])["hw"]
+    else:
+        codes = pd.Series([], dtype=object, name="hw")
+
+    if hws is not None:
+        unseen = pd.Index(pd.unique(pd.Index(hws).astype(object))).difference(codes)
+        if len(unseen) > 0:
+            codes = pd.concat([codes, pd.Series(unseen, name="hw")])
+            codes.reset_index(drop=True, inplace=True)
+            store.write_frame(config, config["hw_codes_file"], codes.to_frame())
+
+    return pd.CategoricalDtype(codes.values)
+
+
+def set_hw_dtype(frame: pd.DataFrame, hw_dtype: pd.CategoricalDtype):
+    """
+    Recodes the hw column or index level with the given categories
+    """
+
+    if "hw" in frame.columns:
+        frame["hw"] = frame["hw"].astype(hw_dtype)
+    elif "hw" in frame.index.names:
+        if isinstance(frame.index, pd.MultiIndex):
+            level = frame.index.levels[frame.index.names.index("hw")]
+            # Levels passed as a list, which also works when the level is empty
+            frame.index = frame.index.set_levels(
+                [pd.CategoricalIndex(level.astype(object), dtype=hw_dtype)],
+                level=["hw"],
+            )
+        else:
+            frame.index = pd.CategoricalIndex(
+                frame.index.astype(object), dtype=hw_dtype, name="hw"
+            )
+    return frame
+
+
+def conform(frame: pd.DataFrame, name: str, hw_dtype=None) -> pd.DataFrame:
+    """
+    Casts the frame's columns to the compact dtypes of the named frame, and its
+    headwords to hw_dtype when given
+    """
+
+    schema = schemas[get_schema_name(name)]
+    dtypes = {c: t for c, t in schema.items() if c in frame.columns}
+    changed = {c: t for c, t in dtypes.items() if frame[c].dtype != t}
+    if len(changed) > 0:
+        frame = frame.astype(changed)
+    if hw_dtype is not None:
+        frame = set_hw_dtype(frame.copy(deep=False), hw_dtype)
+    return frame
+
+
+def read_frame(
+    config, name: str, columns: list = None, filters: list = None
+) -> pd.DataFrame:
+    """
+    Reads a saved frame in its compact dtypes, with the current headword codes
+    """
+
+    frame = store.read_frame(config, name, columns, filters)
+    return conform(frame, name, get_hw_dtype(config))
+
+
+def get_memory_usage(frame: pd.DataFrame) -> int:
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+def get_peak_rss() -> int:
+    """
+    Gets the peak resident set size of the process in bytes, or None where the
+    platform doesn't report it
+    """
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux and the BSDs kilobytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def report_memory(stage: str, frames: dict):
+    """
+    Prints the memory held by each frame and the process's peak RSS so far
+    """
+
+    for name, frame in frames.items():
+        if isinstance(frame, pd.DataFrame):
+            print(
+                "{}: {} {:,} rows {:.1f} MB".format(
+                    stage, name, len(frame.index), get_memory_usage(frame) / 2 ** 20
+                )
+            )
+    peak_rss = get_peak_rss()
+    if peak_rss is not None:
+        print("{}: peak RSS {:.1f} MB".format(stage, peak_rss / 2 ** 20))
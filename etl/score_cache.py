@@ -0,0 +1,85 @@
+"""
+Caches the normalized scores of processed Pleco Databases, so the next run can
+diff against the last snapshot without reading its SQLite file again
+"""
+
+import os
+import pandas as pd
+
+from etl import store
+
+config = {
+    "frame_folder": "frames",
+    "frame_format": "parquet",
+    "score_cache_folder": "score_cache",
+    "score_cache_keep": 2,
+}
+
+time_columns = ["created", "firstreviewedtime", "lastreviewedtime"]
+
+
+def get_cache_name(config, folder: str, db_file: str) -> str:
+    """
+    Gets the frame name for a folder, keyed on the database's size and mtime
+    """
+
+    stat = os.stat(db_file)
+    return os.path.join(
+        config["score_cache_folder"],
+        "{}_{}_{}.pickle".format(folder, stat.st_size, stat.st_mtime_ns),
+    )
+
+
+def compact_scores(scores: pd.DataFrame) -> pd.DataFrame:
+    """
+    Flatten scores into compact columns: categorical hw and integer epoch times
+    """
+
+    compact = scores.reset_index()
+    compact["hw"] = compact["hw"].astype("category")
+    for column in time_columns:
+        compact[column] = compact[column].values.astype("M8[ns]").view("i8")
+    return compact
+
+
+def expand_scores(compact: pd.DataFrame) -> pd.DataFrame:
+    """
+    Restore scores flattened by compact_scores
+    """
+
+    scores = compact.copy()
+    scores["hw"] = scores["hw"].astype(object)
+    for column in time_columns:
+        scores[column] = scores[column].values.view("M8[ns]")
+    scores.set_index(["dictid", "dictentry", "hw", "created"], inplace=True)
+    return scores
+
+
+def read_scores(config, folder: str, db_file: str) -> pd.DataFrame:
+    """
+    Gets the cached scores of a folder, or None if its database isn't cached
+    """
+
+    cache_name = get_cache_name(config, folder, db_file)
+    if not store.frame_exists(config, cache_name):
+        return None
+    return expand_scores(store.read_frame(config, cache_name))
+
+
+def write_scores(config, folder: str, db_file: str, scores: pd.DataFrame):
+    """
+    Caches the scores of a folder and drops all but the most recent folders
+    """
+
+    cache_folder = os.path.join(config["frame_folder"], config["score_cache_folder"])
+    if not os.path.exists(cache_folder):
+        os.mkdir(cache_folder)
+
+    cache_name = get_cache_name(config, folder, db_file)
+    store.write_frame(config, cache_name, compact_scores(scores))
+
+    # File names start with the folder's timestamp, so they sort oldest first
+    extensions = tuple(store.extensions.values())
+    cache_files = sorted(f for f in os.listdir(cache_folder) if f.endswith(extensions))
+    for f in cache_files[: -config["score_cache_keep"]]:
+        os.remove(os.path.join(cache_folder, f))
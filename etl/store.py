@@ -0,0 +1,394 @@
+"""
+Reads and writes the dataframes persisted between stages
+
+Frames are named by their config file name (e.g. "hw_events_stats.pickle") and
+saved in the format chosen by config["frame_format"], parquet unless a config
+says otherwise. Saving removes the frame's file in any other format, and reads
+fall back to any other format found on disk, so existing pickles keep working
+until migrated or rewritten.
+"""
+
+import argparse
+import json
+import operator
+import os
+import pandas as pd
+import uuid
+
+config = {
+    "frame_folder": "frames",
+    "frame_format": "parquet",
+    "frame_compression": "snappy",
+    "frame_row_group_size": 65536,
+    # The first parquet version with nanosecond timestamps, which interpolated
+    # review times need
+    "frame_parquet_version": "2.6",
+    "frame_files": [
+        "card_events.pickle",
+        "card_events_processed.pickle",
+        "hw_events.pickle",
+        "hw_events_stats.pickle",
+        "hw_events_daily.pickle",
+        "hw_events_weekly.pickle",
+        "hw_events_hw_weekly.pickle",
+        "hw_enrichment.pickle",
+        "hw_retention.pickle",
+        "hw_codes.pickle",
+    ],
+}
+
+extensions = {"pickle": ".pickle", "parquet": ".parquet"}
+
+# Configs that don't name a format, like the reports', read what the ETL writes
+default_format = config["frame_format"]
+
+filter_ops = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def get_frame_path(config, name: str, frame_format: str = None) -> str:
+    """
+    Gets the path of a frame in the given (or configured) format
+    """
+
+    for extension in extensions.values():
+        if name.endswith(extension):
+            name = name[: -len(extension)]
+            break
+    if frame_format is None:
+        frame_format = config.get("frame_format", default_format)
+    return os.path.join(config["frame_folder"], name + extensions[frame_format])
+
+
+def find_frame(config, name: str):
+    """
+    Gets the format of a saved frame, preferring the configured format, or None
+    """
+
+    preferred = config.get("frame_format", default_format)
+    for frame_format in [preferred] + [f for f in extensions if f != preferred]:
+        if os.path.exists(get_frame_path(config, name, frame_format)):
+            return frame_format
+    return None
+
+
+def frame_exists(config, name: str) -> bool:
+    return find_frame(config, name) is not None
+
+
+def remove_frame(config, name: str, keep: str = None):
+    """
+    Removes a saved frame in every format but keep
+    """
+
+    for frame_format in extensions:
+        path = get_frame_path(config, name, frame_format)
+        if frame_format != keep and os.path.exists(path):
+            os.remove(path)
+
+
+def apply_filters(frame: pd.DataFrame, filters: list) -> pd.DataFrame:
+    """
+    Filter rows with (column, op, value) tuples, the same form pyarrow accepts
+    """
+
+    mask = pd.Series(True, index=frame.index)
+    for column, op, value in filters:
+        if op == "in":
+            mask &= frame[column].isin(value)
+        else:
+            mask &= filter_ops[op](frame[column], value)
+    return frame[mask.values]
+
+
+def get_date_filters(column: str, start=None, end=None) -> list:
+    """
+    Filters keeping rows with start <= column < end, for a column of dates at
+    midnight
+    """
+
+    filters = []
+    if start is not None:
+        filters.append((column, ">=", pd.Timestamp(start).normalize()))
+    if end is not None:
+        filters.append((column, "<", pd.Timestamp(end).normalize()))
+    return filters
+
+
+def select(frame: pd.DataFrame, columns: list = None, filters: list = None):
+    """
+    Applies read_frame's column and row selection to a frame already in memory
+    """
+
+    if filters:
+        frame = apply_filters(frame, filters)
+    if columns is not None:
+        frame = frame[columns]
+    return frame
+
+
+def read_pickle_frame(path: str, columns: list, filters: list) -> pd.DataFrame:
+    return select(pd.read_pickle(path), columns, filters)
+
+
+def write_pickle_frame(config, path: str, frame: pd.DataFrame, sort_by: str):
+    frame.to_pickle(path)
+
+
+def read_parquet_frame(path: str, columns: list, filters: list) -> pd.DataFrame:
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(
+        path, columns=columns, filters=filters or None, use_pandas_metadata=True
+    )
+    frame = table.to_pandas()
+
+    # Frames sorted by a column for row group pruning go back to index order
+    if not frame.index.is_monotonic_increasing:
+        frame.sort_index(inplace=True)
+    return frame
+
+
+def write_parquet_frame(config, path: str, frame: pd.DataFrame, sort_by: str):
+    # Sorting by the column readers filter on keeps each row group's range narrow
+    if sort_by is not None:
+        frame = frame.sort_values(by=sort_by, kind="mergesort")
+    frame.to_parquet(
+        path,
+        engine="pyarrow",
+        compression=config.get("frame_compression", "snappy"),
+        row_group_size=config.get("frame_row_group_size", 65536),
+        version=config.get("frame_parquet_version", "2.6"),
+    )
+
+
+backends = {
+    "pickle": (read_pickle_frame, write_pickle_frame),
+    "parquet": (read_parquet_frame, write_parquet_frame),
+}
+
+
+def read_frame(
+    config, name: str, columns: list = None, filters: list = None
+) -> pd.DataFrame:
+    """
+    Reads a saved frame, loading only the given columns and the rows matching
+    the given filters where the format allows it. Index levels are always read.
+    """
+
+    frame_format = find_frame(config, name)
+    if frame_format is None:
+        raise FileNotFoundError(get_frame_path(config, name))
+    read, _ = backends[frame_format]
+    return read(get_frame_path(config, name, frame_format), columns, filters)
+
+
+def write_frame(config, name: str, frame: pd.DataFrame, sort_by: str = None):
+    """
+    Saves a frame in the configured format. Columnar formats store the rows
+    ordered by sort_by, so filters on that column can skip whole row groups.
+    """
+
+    if not os.path.exists(config["frame_folder"]):
+        os.mkdir(config["frame_folder"])
+
+    frame_format = config.get("frame_format", default_format)
+    _, write = backends[frame_format]
+    write(config, get_frame_path(config, name, frame_format), frame, sort_by)
+
+    # A copy left in another format would go stale, and a reader preferring
+    # that format would pick it up
+    remove_frame(config, name, keep=frame_format)
+
+
+def write_frame_chunks(config, name: str, chunks):
+    """
+    Saves frames arriving one chunk at a time as a single frame. Parquet appends
+    each chunk to the file as it comes, so only one is held in memory; pickle has
+    to gather them all first.
+    """
+
+    if not os.path.exists(config["frame_folder"]):
+        os.mkdir(config["frame_folder"])
+
+    frame_format = config.get("frame_format", default_format)
+    if frame_format != "parquet":
+        write_frame(config, name, pd.concat(list(chunks)))
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Written aside and renamed, so an interrupted build keeps the old frame
+    path = get_frame_path(config, name, frame_format)
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk)
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    path + ".part",
+                    table.schema,
+                    compression=config.get("frame_compression", "snappy"),
+                    version=config.get("frame_parquet_version", "2.6"),
+                )
+            writer.write_table(
+                table, row_group_size=config.get("frame_row_group_size", 65536)
+            )
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError("No chunks to save as {}".format(name))
+    os.replace(path + ".part", path)
+    remove_frame(config, name, keep=frame_format)
+
+
+def get_version_path(config) -> str:
+    return os.path.join(
+        config["frame_folder"], config.get("etl_version_file", "etl_version.json")
+    )
+
+
+def write_version(config):
+    """
+    Stamps the saved frames with a new version, so anything cached from them
+    knows to recompute
+    """
+
+    with open(get_version_path(config), "w") as f:
+        json.dump(
+            {"version": uuid.uuid4().hex, "written": pd.Timestamp.now().isoformat()}, f
+        )
+
+
+def read_version(config) -> str:
+    """
+    Gets the version of the saved frames, or None if they were never stamped
+    """
+
+    path = get_version_path(config)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)["version"]
+
+
+def get_dataset_folder(config, name: str) -> str:
+    """
+    Gets the folder holding the partitions of a dataset
+    """
+
+    return os.path.splitext(get_frame_path(config, name))[0]
+
+
+def list_partitions(config, name: str) -> list:
+    """
+    Gets the sorted partition names of a dataset
+    """
+
+    dataset_folder = get_dataset_folder(config, name)
+    if not os.path.exists(dataset_folder):
+        return []
+    partitions = set()
+    for f in os.listdir(dataset_folder):
+        partition, extension = os.path.splitext(f)
+        if extension in extensions.values():
+            partitions.add(partition)
+    return sorted(partitions)
+
+
+def get_partition_name(name: str, partition: str) -> str:
+    dataset = os.path.splitext(name)[0]
+    return os.path.join(dataset, partition + extensions["pickle"])
+
+
+def read_partition(
+    config, name: str, partition: str, columns: list = None, filters: list = None
+) -> pd.DataFrame:
+    return read_frame(config, get_partition_name(name, partition), columns, filters)
+
+
+def write_partition(config, name: str, partition: str, frame: pd.DataFrame):
+    dataset_folder = get_dataset_folder(config, name)
+    if not os.path.exists(dataset_folder):
+        os.makedirs(dataset_folder)
+    write_frame(config, get_partition_name(name, partition), frame)
+
+
+def remove_partition(config, name: str, partition: str):
+    remove_frame(config, get_partition_name(name, partition))
+
+
+def read_dataset(
+    config,
+    name: str,
+    partitions: list = None,
+    columns: list = None,
+    filters: list = None,
+) -> pd.DataFrame:
+    """
+    Reads the partitions of a dataset (all of them by default) as one frame. A
+    dataset nothing was written to yet reads as a frame without rows.
+    """
+
+    if partitions is None:
+        partitions = list_partitions(config, name)
+    if len(partitions) == 0:
+        from etl import schema
+
+        return schema.get_empty_frame(name, columns)
+
+    frames = [read_partition(config, name, p, columns, filters) for p in partitions]
+    frame = pd.concat(frames)
+    frame.sort_index(inplace=True)
+    return frame
+
+
+def migrate_frame(config, name: str, frame_format: str):
+    """
+    Rewrites a saved frame in another format and removes the old file
+    """
+
+    source_format = find_frame(config, name)
+    if source_format is None or source_format == frame_format:
+        return
+    source_path = get_frame_path(config, name, source_format)
+    read, _ = backends[source_format]
+    frame = read(source_path, None, None)
+    sort_by = "revieweddate" if "revieweddate" in frame.columns else None
+    # Writing the new format removes the old file
+    write_frame(dict(config, frame_format=frame_format), name, frame, sort_by)
+    print("Migrated {} to {}".format(source_path, frame_format))
+
+
+def migrate(config, frame_format: str):
+    """
+    Rewrites the saved frames and dataset partitions in another format
+    """
+
+    for name in config["frame_files"]:
+        migrate_frame(config, name, frame_format)
+        for partition in list_partitions(config, name):
+            migrate_frame(config, get_partition_name(name, partition), frame_format)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the saved frames")
+    subparsers = parser.add_subparsers(dest="command")
+    migrate_parser = subparsers.add_parser("migrate", help="convert saved frames")
+    migrate_parser.add_argument(
+        "--to", choices=sorted(backends), default=config["frame_format"]
+    )
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate(config, args.to)
+    else:
+        parser.print_help()
@@ -0,0 +1,105 @@
+"""
+Converts epoch times to naive local times
+
+The UTC offsets come from the timezone's transition table in the tz database.
+Each time is matched to the period it falls in, then shifted by that period's
+offset as an int64. Rather than binary searching every time, the period at the
+start of each day is looked up once and a time only has to be compared with
+the one transition its day may hold.
+"""
+
+import datetime
+import functools
+import numpy as np
+import pytz
+
+nat = np.iinfo("i8").min
+day = 24 * 60 * 60 * 10 ** 9
+
+# The day table has a row for every day the times span, so longer spans fall
+# back to binary searching each time
+max_days = 1000000
+
+
+@functools.lru_cache()
+def get_transitions(timezone: str) -> tuple:
+    """
+    Gets the UTC start of each of the timezone's offset periods in epoch
+    nanoseconds, and the offset of each period in nanoseconds
+    """
+
+    tz = pytz.timezone(timezone)
+    if not hasattr(tz, "_utc_transition_times"):
+        offset = tz.utcoffset(datetime.datetime(2000, 1, 1))
+        return (
+            np.array([nat], dtype="i8"),
+            np.array([offset // datetime.timedelta(microseconds=1) * 1000], dtype="i8"),
+        )
+
+    # The first period starts at datetime.min, far outside the nanosecond range
+    seconds = np.array(tz._utc_transition_times, dtype="M8[s]").astype("i8")
+    starts = np.maximum(seconds, nat // 10 ** 9) * 10 ** 9
+    starts[0] = nat
+    offsets = np.array(
+        [
+            offset // datetime.timedelta(microseconds=1) * 1000
+            for offset, _, _ in tz._transition_info
+        ],
+        dtype="i8",
+    )
+    return starts, offsets
+
+
+def get_day_periods(starts: np.ndarray, first: int, last: int, days: np.ndarray):
+    """
+    Gets the period in effect at the start of each of the days, which are
+    counted from the first, or None if a day in range holds two transitions
+    """
+
+    day_starts = np.arange(first, last + 1) * day
+    periods = np.searchsorted(starts, day_starts, side="right") - 1
+    following = np.append(starts, [np.iinfo("i8").max] * 2)[periods + 2]
+    if (following < day_starts + day).any():
+        return None
+    return periods[days]
+
+
+def to_local(times: np.ndarray, timezone: str) -> np.ndarray:
+    """
+    Converts UTC datetime64[ns] times to naive local times, keeping NaT
+    """
+
+    values = np.asarray(times, dtype="M8[ns]").view("i8")
+    starts, offsets = get_transitions(timezone)
+    missing = values == nat
+    if missing.all():
+        return values.view("M8[ns]").copy()
+
+    first = values[~missing].min() // day
+    last = values[~missing].max() // day
+    periods = None
+    if last - first < max_days:
+        days = np.where(missing, first, values // day) - first
+        periods = get_day_periods(starts, first, last, days)
+        if periods is not None:
+            periods += values >= np.append(starts, np.iinfo("i8").max)[periods + 1]
+    if periods is None:
+        periods = np.searchsorted(starts, values, side="right") - 1
+
+    local = values + offsets[periods]
+    local[missing] = nat
+    return local.view("M8[ns]")
+
+
+def from_epoch_seconds(seconds: np.ndarray, timezone: str) -> np.ndarray:
+    """
+    Converts epoch seconds, NaN where missing, to naive local datetime64[ns]
+    """
+
+    seconds = np.asarray(seconds, dtype="f8")
+    missing = np.isnan(seconds)
+    seconds = np.where(missing, 0, seconds)
+    whole = np.floor(seconds)
+    ns = whole.astype("i8") * 10 ** 9 + np.round((seconds - whole) * 1e9).astype("i8")
+    ns[missing] = nat
+    return to_local(ns.view("M8[ns]"), timezone)
@@ -0,0 +1,156 @@
+"""
+One command line for the ETL stages, reports and benchmarks
+
+    python -m pleco status
+    python -m pleco etl run --download
+    python -m pleco report weekly
+
+Each command runs its module as if started with python -m, so it takes the
+same options. Modules are only imported once their command is picked, which
+keeps pandas, matplotlib and the Google client out of the quick commands.
+"""
+
+import argparse
+import json
+import os
+import re
+import runpy
+import sys
+
+config = {
+    "db_folder": "data",
+    "db_folder_rx": r"^\d{4}-\d{2}-\d{2} \d{2}.\d{2}.\d{2}$",
+    "db_file": "Pleco Flashcard Database.pqb",
+    "frame_folder": "frames",
+    "state_file": "pipeline_state.json",
+    "metrics_file": "metrics.jsonl",
+}
+
+# group -> command -> (module, help)
+commands = {
+    "etl": {
+        "run": ("etl.pipeline", "run the ETL stages and reports"),
+        "download": ("etl.download", "download new Pleco Databases"),
+        "card-events": ("etl.card_events", "extract card review events"),
+        "hw-events": ("etl.hw_events", "build headword review events"),
+        "hw-events-stats": ("etl.hw_events_stats", "build headword review stats"),
+        "retention": ("etl.retention", "fit headword forgetting curves"),
+        "metrics": ("etl.metrics", "summarize the latest run's stage metrics"),
+    },
+    "report": {
+        "all-time": ("all_time", "plot the all time report"),
+        "weekly": ("weekly_vocab", "email the weekly vocabulary report"),
+    },
+    "bench": {
+        "suite": ("bench.suite", "benchmark the ETL and reports end to end"),
+        "generate": ("bench.generate", "generate Pleco Database snapshots"),
+        "startup": ("bench.startup", "check the quick commands start within budget"),
+        "sftp": ("bench.sftp", "check downloads against a local SFTP stand-in"),
+        "score-cache": (
+            "bench.score_cache",
+            "check a cold score cache changes nothing",
+        ),
+    },
+}
+
+
+def get_snapshots(config) -> list:
+    """
+    Gets the complete snapshot folders, oldest first
+    """
+
+    if not os.path.exists(config["db_folder"]):
+        return []
+    db_folder_rx = re.compile(config["db_folder_rx"])
+    return sorted(
+        f
+        for f in os.listdir(config["db_folder"])
+        if db_folder_rx.match(f)
+        and os.path.exists(os.path.join(config["db_folder"], f, config["db_file"]))
+    )
+
+
+def get_last_run(config) -> list:
+    """
+    Gets the metrics records of the latest recorded run
+    """
+
+    path = os.path.join(config["frame_folder"], config["metrics_file"])
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if len(records) == 0:
+        return []
+    return [r for r in records if r["run"] == records[-1]["run"]]
+
+
+def status(config):
+    """
+    Prints the snapshots on disk and what the last ETL run did, without loading
+    any frames
+    """
+
+    snapshots = get_snapshots(config)
+    print("{} snapshots in {}".format(len(snapshots), config["db_folder"]))
+    if len(snapshots) > 0:
+        print("Latest snapshot: {}".format(snapshots[-1]))
+
+    state_file = os.path.join(config["frame_folder"], config["state_file"])
+    if os.path.exists(state_file):
+        last_run = os.path.getmtime(state_file)
+        pending = [
+            f
+            for f in snapshots
+            if os.path.getmtime(os.path.join(config["db_folder"], f, config["db_file"]))
+            > last_run
+        ]
+        print("Snapshots added since the last ETL run: {}".format(len(pending)))
+    else:
+        print("The ETL pipeline hasn't run yet")
+
+    for record in get_last_run(config):
+        if "/" not in record["stage"]:
+            print(
+                "{:>16}: {:8.3f}s {:8.1f} MB".format(
+                    record["stage"], record["wall"], (record["peak_rss"] or 0) / 2 ** 20
+                )
+            )
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m pleco",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    groups = parser.add_subparsers(dest="group", metavar="group")
+    groups.required = True
+    groups.add_parser("status", help="show the snapshots and the last ETL run")
+    for group, group_commands in commands.items():
+        group_parser = groups.add_parser(group, help="{} commands".format(group))
+        subparsers = group_parser.add_subparsers(dest="command", metavar="command")
+        subparsers.required = True
+        for command, (_, command_help) in group_commands.items():
+            # Options, --help included, are left for the command's own parser
+            subparsers.add_parser(command, help=command_help, add_help=False)
+    return parser
+
+
+def main(argv: list):
+    parser = get_parser()
+    args, options = parser.parse_known_args(argv)
+    if args.group == "status":
+        if len(options) > 0:
+            parser.error("unrecognized arguments: {}".format(" ".join(options)))
+        status(config)
+        return
+
+    # run_module points sys.argv[0] at the module, as python -m would
+    module, _ = commands[args.group][args.command]
+    sys.argv = sys.argv[:1] + options
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
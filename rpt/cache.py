@@ -0,0 +1,115 @@
+"""
+Caches finished reports until the ETL saves new stats
+
+Report frames and rendered artifacts (PNG charts, HTML bodies) are saved under
+a key made of the report name, its date window and the version the ETL stamps
+on every save. Once the cache grows past its size limit, the entries used
+least recently are evicted.
+"""
+
+import hashlib
+import json
+import os
+import pandas as pd
+
+from etl import store
+
+config = {
+    "frame_folder": "frames",
+    "report_cache_folder": "report_cache",
+    "report_cache_size": 2 ** 26,
+    "etl_version_file": "etl_version.json",
+}
+
+extensions = {"frame": ".pickle", "png": ".png", "html": ".html"}
+
+
+def get_cache_folder(config) -> str:
+    return os.path.join(
+        config["frame_folder"],
+        config.get("report_cache_folder", "report_cache"),
+    )
+
+
+def get_key(report: str, start, end, version: str) -> str:
+    """
+    Gets the cache key of a report. Reports only look at review dates, so the
+    window is keyed by day.
+    """
+
+    window = [None if d is None else pd.Timestamp(d).normalize() for d in [start, end]]
+    key = [report] + [None if d is None else d.isoformat() for d in window] + [version]
+    return hashlib.sha1(json.dumps(key).encode("utf8")).hexdigest()
+
+
+def read_entry(path: str, kind: str):
+    if kind == "frame":
+        return pd.read_pickle(path)
+    with open(path, "rb") as f:
+        value = f.read()
+    return value.decode("utf8") if kind == "html" else value
+
+
+def write_entry(path: str, kind: str, value):
+    # Written aside and renamed, so a reader never sees half an entry
+    part_path = path + ".part"
+    if kind == "frame":
+        value.to_pickle(part_path)
+    else:
+        with open(part_path, "wb") as f:
+            f.write(value.encode("utf8") if kind == "html" else value)
+    os.replace(part_path, path)
+
+
+def evict(config):
+    """
+    Removes the least recently used entries until the cache fits its size
+    """
+
+    folder = get_cache_folder(config)
+    entries = []
+    for f in os.listdir(folder):
+        stat = os.stat(os.path.join(folder, f))
+        entries.append((stat.st_mtime_ns, stat.st_size, f))
+    entries.sort()
+
+    size = sum(e[1] for e in entries)
+    limit = config.get("report_cache_size", 2 ** 26)
+    for _, entry_size, f in entries:
+        if size <= limit:
+            break
+        os.remove(os.path.join(folder, f))
+        size -= entry_size
+
+
+def memoize(
+    config,
+    report: str,
+    compute,
+    start=None,
+    end=None,
+    kind: str = "frame",
+    hw_stats: pd.DataFrame = None,
+):
+    """
+    Gets the report from the cache, or computes and caches it. Stats passed in
+    memory and stats the ETL never stamped are computed every time.
+    """
+
+    version = store.read_version(config)
+    if hw_stats is not None or version is None:
+        return compute()
+
+    folder = get_cache_folder(config)
+    path = os.path.join(folder, get_key(report, start, end, version) + extensions[kind])
+    if os.path.exists(path):
+        # Touching the entry marks it as recently used
+        os.utime(path)
+        return read_entry(path, kind)
+
+    value = compute()
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    write_entry(path, kind, value)
+    evict(config)
+    return value
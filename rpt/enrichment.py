@@ -0,0 +1,102 @@
+"""
+Keeps the pinyin and CC-CEDICT definitions of every headword seen so far
+
+A headword's pinyin and definitions never change, so they are looked up once and
+saved. Lookups only happen for headwords missing from the saved table, and the
+CEDICT dictionary is only loaded when definitions are asked for.
+"""
+
+import pandas as pd
+
+from etl import store
+
+config = {
+    "frame_folder": "frames",
+    "frame_format": "parquet",
+    "hw_enrichment_file": "hw_enrichment.pickle",
+}
+
+
+def get_pinyin(hws: list) -> list:
+    import pinyin
+
+    return [pinyin.get(hw) for hw in hws]
+
+
+def get_definitions(hws: list) -> list:
+    # Loading the dictionary takes a second or two, on the first lookup
+    import pinyin.cedict
+
+    return [pinyin.cedict.translate_word(hw) for hw in hws]
+
+
+def read_enrichment(config) -> pd.DataFrame:
+    if not store.frame_exists(config, config["hw_enrichment_file"]):
+        return pd.DataFrame(
+            {
+                "pinyin": pd.Series([], dtype=object),
+                "defined": pd.Series([], dtype=bool),
+                "definition": pd.Series([], dtype=object),
+            },
+            index=pd.Index([], name="hw"),
+        )
+    return store.read_frame(config, config["hw_enrichment_file"])
+
+
+def update_enrichment(
+    config, enrichment: pd.DataFrame, hws: pd.Index, definitions: bool
+) -> pd.DataFrame:
+    """
+    Looks up the headwords missing from the table, and their definitions if
+    asked for and not looked up yet. defined tells a headword CEDICT has no
+    definition for (None) from one it wasn't asked about.
+    """
+
+    unseen = hws.difference(enrichment.index)
+    if len(unseen) > 0:
+        enrichment = pd.concat(
+            [
+                enrichment,
+                pd.DataFrame(
+                    {
+                        "pinyin": get_pinyin(unseen),
+                        "defined": False,
+                        "definition": None,
+                    },
+                    index=unseen.rename("hw"),
+                ),
+            ]
+        )
+
+    undefined = pd.Index([], name="hw")
+    if definitions:
+        rows = enrichment.reindex(hws)
+        undefined = rows.index[~rows["defined"].astype(bool)]
+        if len(undefined) > 0:
+            enrichment.loc[undefined, "definition"] = pd.Series(
+                get_definitions(undefined), index=undefined, dtype=object
+            )
+            enrichment.loc[undefined, "defined"] = True
+
+    if len(unseen) > 0 or len(undefined) > 0:
+        enrichment.sort_index(inplace=True)
+        store.write_frame(config, config["hw_enrichment_file"], enrichment)
+    return enrichment
+
+
+def get_enrichment(config, hws: pd.Index, definitions: bool = True) -> pd.DataFrame:
+    """
+    Gets the pinyin, and optionally the definitions, of the headwords, indexed
+    like hws
+    """
+
+    enrichment = read_enrichment(config)
+    enrichment = update_enrichment(config, enrichment, hws, definitions)
+
+    enriched = enrichment.reindex(hws)[["pinyin"]]
+    if definitions:
+        # Columnar formats read lists back as arrays
+        enriched["definition"] = [
+            d if d is None else list(d) for d in enrichment["definition"].reindex(hws)
+        ]
+    return enriched
@@ -0,0 +1,79 @@
+"""
+Loads hw_events_stats once per process and shares it between reports
+"""
+
+import numpy as np
+import os
+import pandas as pd
+
+from etl import schema, store
+
+# Saved frame path -> (mtime, stats sorted by revieweddate)
+cache = {}
+
+
+def get_cached_stats(config, columns: list) -> pd.DataFrame:
+    """
+    Gets the saved stats ordered by revieweddate, with at least the given
+    columns, reading from disk only when the file changed or columns are missing
+    """
+
+    name = config["hw_events_stats_file"]
+    path = store.get_frame_path(config, name, store.find_frame(config, name))
+    mtime = os.stat(path).st_mtime_ns
+
+    if path in cache and cache[path][0] == mtime:
+        stats = cache[path][1]
+        missing = [c for c in columns if c not in stats.columns]
+    else:
+        stats = None
+        missing = ["revieweddate"] + [c for c in columns if c != "revieweddate"]
+
+    if len(missing) > 0:
+        loaded = schema.conform(store.read_frame(config, name, missing), name)
+        if stats is None:
+            # A stable sort keeps each headword's events in occurrence order
+            stats = loaded.sort_values(by="revieweddate", kind="mergesort")
+        else:
+            stats = stats.join(loaded)
+        cache[path] = (mtime, stats)
+
+    return stats
+
+
+def load_stats(
+    config,
+    start: pd.Timestamp = None,
+    end: pd.Timestamp = None,
+    columns: list = None,
+    hw_stats: pd.DataFrame = None,
+    cached: bool = True,
+) -> pd.DataFrame:
+    """
+    Gets the stats reviewed in [start, end). Each headword's rows are in review
+    order, but headwords may be interleaved.
+
+    Cached stats are returned as a slice of the shared frame, which may carry more
+    columns than asked for; callers must copy before modifying it. Without the
+    cache, only the window and columns asked for are read from disk.
+    """
+
+    if columns is None:
+        columns = []
+    filters = store.get_date_filters("revieweddate", start, end)
+
+    if hw_stats is not None:
+        return store.select(hw_stats, columns, filters)
+    if not cached:
+        name = config["hw_events_stats_file"]
+        return schema.conform(store.read_frame(config, name, columns, filters), name)
+
+    stats = get_cached_stats(config, columns)
+    dates = stats["revieweddate"].values
+    first, last = 0, len(dates)
+    for _, op, value in filters:
+        if op == ">=":
+            first = np.searchsorted(dates, value.to_datetime64(), side="left")
+        else:
+            last = np.searchsorted(dates, value.to_datetime64(), side="left")
+    return stats.iloc[first:last]
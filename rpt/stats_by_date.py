@@ -1,40 +1,94 @@
-import os
 import pandas as pd
 
-config = {"frame_folder": "frames", "hw_events_stats_file": "hw_events_stats.pickle"}
+from etl import metrics, schema, store
+from etl.rollups import get_daily_stats, get_weekly_stats
+from rpt.loader import load_stats
 
+config = {
+    "frame_folder": "frames",
+    "frame_format": "parquet",
+    "hw_events_stats_file": "hw_events_stats.pickle",
+    "hw_events_daily_file": "hw_events_daily.pickle",
+    "hw_events_weekly_file": "hw_events_weekly.pickle",
+}
 
-def get_stats_by_date(
-    config, start: pd.Timestamp = None, end: pd.Timestamp = None
+
+def load_daily_stats(
+    config,
+    start: pd.Timestamp = None,
+    end: pd.Timestamp = None,
+    hw_stats: pd.DataFrame = None,
+) -> pd.DataFrame:
+    """
+    Gets the daily totals reviewed in [start, end), from the rollup the ETL keeps
+    when it exists
+    """
+
+    filters = store.get_date_filters("revieweddate", start, end)
+    daily_file = config.get("hw_events_daily_file", "hw_events_daily.pickle")
+
+    if hw_stats is None and store.frame_exists(config, daily_file):
+        daily = store.read_frame(config, daily_file, filters=filters)
+        return schema.conform(daily, daily_file)
+    stats = load_stats(config, start, end, ["revieweddate", "netlearned"], hw_stats)
+    return get_daily_stats(stats)
+
+
+def load_weekly_stats(
+    config,
+    start: pd.Timestamp = None,
+    end: pd.Timestamp = None,
+    hw_stats: pd.DataFrame = None,
 ) -> pd.DataFrame:
-    stats_file = os.path.join(config["frame_folder"], config["hw_events_stats_file"])
-    hw_stats = pd.read_pickle(stats_file)
+    """
+    Gets the totals of the ISO weeks starting in [start, end), from the rollup
+    the ETL keeps when it exists
+    """
+
+    filters = store.get_date_filters("week", start, end)
+    weekly_file = config.get("hw_events_weekly_file", "hw_events_weekly.pickle")
 
-    stats = hw_stats.copy()
-    if start is not None:
-        stats = stats[stats["revieweddate"] >= start].copy()
-    if end is not None:
-        stats = stats[stats["revieweddate"] < end].copy()
+    if hw_stats is None and store.frame_exists(config, weekly_file):
+        weekly = store.read_frame(config, weekly_file, filters=filters)
+        return schema.conform(weekly, weekly_file)
+    daily = load_daily_stats(config, hw_stats=hw_stats)
+    return store.select(get_weekly_stats(daily), filters=filters)
 
+
+def get_report(totals: pd.DataFrame) -> pd.DataFrame:
     rpt = pd.DataFrame(
-        {"reviewed": stats.groupby(["revieweddate"]).size().astype("u2")}
+        {"reviewed": totals["reviewed"].values.astype("u2")},
+        index=pd.Index(totals.index.date, name=totals.index.name),
     )
-    rpt["new"] = hw_stats.query("occurrence == 0").groupby(["revieweddate"]).size()
-    rpt["learned"] = hw_stats.query("netlearned == 1").groupby(["revieweddate"]).size()
-    rpt["forgot"] = hw_stats.query("netlearned == -1").groupby(["revieweddate"]).size()
-    rpt["netlearned"] = hw_stats.groupby(["revieweddate"])["netlearned"].sum()
+    rpt["new"] = totals["new"].values.astype("u2")
+    rpt["learned"] = totals["learned"].values.astype("u2")
+    rpt["forgot"] = totals["forgot"].values.astype("u2")
+    rpt["netlearned"] = totals["netlearned"].values.astype("i2")
 
-    rpt["new"] = rpt["new"].fillna(0).astype("u2")
-    rpt["learned"] = rpt["learned"].fillna(0).astype("u2")
-    rpt["forgot"] = rpt["forgot"].fillna(0).astype("u2")
-    rpt["netlearned"] = rpt["netlearned"].fillna(0).astype("i2")
+    rpt["cumreviewed"] = rpt["reviewed"].cumsum().astype("u2")
+    rpt["cumnew"] = rpt["new"].cumsum().astype("u2")
+    rpt["cumnetlearned"] = rpt["netlearned"].cumsum().astype("i2")
 
-    rpt["cumreviewed"] = rpt["reviewed"].cumsum()
-    rpt["cumnew"] = rpt["new"].cumsum()
-    rpt["cumnetlearned"] = rpt["netlearned"].cumsum()
+    return rpt
 
-    rpt["cumreviewed"] = rpt["cumreviewed"].fillna(0).astype("u2")
-    rpt["cumnew"] = rpt["cumnew"].fillna(0).astype("u2")
-    rpt["cumnetlearned"] = rpt["cumnetlearned"].fillna(0).astype("i2")
 
-    return rpt
+@metrics.measured("rpt/stats_by_date")
+def get_stats_by_date(
+    config,
+    start: pd.Timestamp = None,
+    end: pd.Timestamp = None,
+    hw_stats: pd.DataFrame = None,
+) -> pd.DataFrame:
+    daily = load_daily_stats(config, start, end, hw_stats)
+    return get_report(daily.set_index("revieweddate").sort_index())
+
+
+@metrics.measured("rpt/stats_by_week")
+def get_stats_by_week(
+    config,
+    start: pd.Timestamp = None,
+    end: pd.Timestamp = None,
+    hw_stats: pd.DataFrame = None,
+) -> pd.DataFrame:
+    weekly = load_weekly_stats(config, start, end, hw_stats)
+    return get_report(weekly.set_index("week").sort_index())
@@ -1,68 +1,94 @@
-import os
 import pandas as pd
-import pinyin
-import pinyin.cedict
 
-config = {"frame_folder": "frames", "hw_events_stats_file": "hw_events_stats.pickle"}
+from etl import metrics, retention, schema, store
+from etl.rollups import combine_hw_summaries, get_hw_summaries, get_week_start
+from rpt import enrichment
+from rpt.loader import load_stats
 
+config = {
+    "frame_folder": "frames",
+    "frame_format": "parquet",
+    "hw_events_stats_file": "hw_events_stats.pickle",
+    "hw_events_hw_weekly_file": "hw_events_hw_weekly.pickle",
+}
 
-def get_stats_by_hw(
-    config, start: pd.Timestamp = None, end: pd.Timestamp = None
+columns = ["revieweddate", "result", "invresult", "laglearned", "netlearned"]
+
+
+def load_hw_summaries(
+    config,
+    start: pd.Timestamp = None,
+    end: pd.Timestamp = None,
+    hw_stats: pd.DataFrame = None,
 ) -> pd.DataFrame:
+    """
+    Gets (hw, week) summaries covering [start, end). Whole weeks come from the
+    rollup the ETL keeps when it exists, and the days around them from the stats.
+    """
 
-    stats_file = os.path.join(config["frame_folder"], config["hw_events_stats_file"])
-    hw_stats = pd.read_pickle(stats_file)
-
-    stats = hw_stats.copy()
-    if start is not None:
-        stats = stats[stats["revieweddate"] >= start].copy()
-    if end is not None:
-        stats = stats[stats["revieweddate"] < end].copy()
-
-    first_review = stats.groupby(["hw"]).head(1).reset_index().set_index("hw").copy()
-    last_review = stats.groupby(["hw"]).tail(1).reset_index().set_index("hw").copy()
-
-    first_change = (
-        stats[stats["netlearned"] != 0]
-        .groupby(["hw"])
-        .head(1)
-        .reset_index()
-        .set_index("hw")
-        .copy()
-    )
-    last_change = (
-        stats[stats["netlearned"] != 0]
-        .groupby(["hw"])
-        .tail(1)
-        .reset_index()
-        .set_index("hw")
-        .copy()
+    hw_weekly_file = config.get(
+        "hw_events_hw_weekly_file", "hw_events_hw_weekly.pickle"
     )
+    if hw_stats is not None or not store.frame_exists(config, hw_weekly_file):
+        return get_hw_summaries(load_stats(config, start, end, columns, hw_stats))
 
-    rpt = pd.DataFrame({"reviewed": stats.groupby(["hw"]).size().astype("u2")})
+    first_week = None if start is None else get_week_start(start, later=True)
+    last_week = None if end is None else get_week_start(end)
+    if first_week is not None and last_week is not None and first_week >= last_week:
+        stats = load_stats(config, start, end, columns, cached=False)
+        return get_hw_summaries(stats)
 
-    rpt["firstreviewed"] = first_review["revieweddate"]
-    rpt["lastreviewed"] = last_review["revieweddate"]
+    filters = store.get_date_filters("week", first_week, last_week)
+    hw_weekly = store.read_frame(config, hw_weekly_file, filters=filters)
+    summaries = [schema.conform(hw_weekly, hw_weekly_file)]
+    if start is not None and pd.Timestamp(start).normalize() < first_week:
+        stats = load_stats(config, start, first_week, columns, cached=False)
+        summaries.append(get_hw_summaries(stats))
+    if end is not None and last_week < pd.Timestamp(end).normalize():
+        stats = load_stats(config, last_week, end, columns, cached=False)
+        summaries.append(get_hw_summaries(stats))
+    return pd.concat(summaries)
 
-    rpt["correct"] = stats.groupby(["hw"])[["result"]].sum().astype("u2")
-    rpt["incorrect"] = stats.groupby(["hw"])[["invresult"]].sum().astype("u2")
 
-    rpt["new"] = first_review["occurrence"].apply(lambda x: x == 0)
-    rpt["knew"] = first_review["laglearned"].apply(lambda x: x == True)
-    rpt["learned"] = first_change["netlearned"].apply(lambda x: x == 1)
-    rpt["forgot"] = first_change["netlearned"].apply(lambda x: x == -1)
+def get_recall(config, hws: pd.Index) -> pd.DataFrame:
+    """
+    Gets each headword's half-life and the chance it is recalled now
+    """
 
-    rpt["knew"] = rpt["knew"].fillna(False)
-    rpt["learned"] = rpt["learned"].fillna(False)
-    rpt["forgot"] = rpt["forgot"].fillna(False)
+    retention_config = dict(retention.config, **config)
+    return retention.get_recall(retention_config, hws)
 
-    rpt["know"] = rpt.apply(
-        lambda row: row["learned"] or (row["knew"] and not row["forgot"]), axis=1
-    )
 
-    rpt["pinyin"] = rpt.apply(lambda row: pinyin.get(row.name), axis=1)
-    rpt["definition"] = rpt.apply(
-        lambda row: pinyin.cedict.translate_word(row.name), axis=1
-    )
+@metrics.measured("rpt/stats_by_hw")
+def get_stats_by_hw(
+    config,
+    start: pd.Timestamp = None,
+    end: pd.Timestamp = None,
+    hw_stats: pd.DataFrame = None,
+    definitions: bool = True,
+    recall: bool = True,
+) -> pd.DataFrame:
+
+    rpt = combine_hw_summaries(load_hw_summaries(config, start, end, hw_stats))
+    rpt.index = rpt.index.astype(object)
+    rpt.sort_index(inplace=True)
+
+    rpt["firstreviewed"] = rpt["firstreviewed"].dt.date
+    rpt["lastreviewed"] = rpt["lastreviewed"].dt.date
+    rpt["reviewed"] = rpt["reviewed"].astype("u2")
+    rpt["correct"] = rpt["correct"].astype("u2")
+    rpt["incorrect"] = rpt["incorrect"].astype("u2")
+    rpt["new"] = rpt["new"].astype(bool)
+    rpt["knew"] = rpt["knew"].astype(bool)
+    firstchange = rpt.pop("firstchange")
+    rpt["learned"] = firstchange == 1
+    rpt["forgot"] = firstchange == -1
+    rpt["know"] = rpt["learned"] | (rpt["knew"] & ~rpt["forgot"])
+
+    enrichment_config = dict(enrichment.config, **config)
+    rpt = rpt.join(enrichment.get_enrichment(enrichment_config, rpt.index, definitions))
+
+    if recall:
+        rpt = rpt.join(get_recall(config, rpt.index))
 
     return rpt
@@ -8,12 +8,8 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart, MIMEBase
 from email.mime.image import MIMEImage
 from email.mime.audio import MIMEAudio
-from googleapiclient.errors import HttpError
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from rpt.stats_by_date import get_stats_by_date
-from rpt.stats_by_hw import get_stats_by_hw
+from rpt import cache
+from rpt.stats_by_hw import get_recall, get_stats_by_hw
 
 config = {
     "frame_folder": "frames",
@@ -24,11 +20,23 @@ config = {
 }
 
 
+def get_window() -> tuple:
+    end = pd.Timestamp.today()
+    return end - pd.DateOffset(7, "D"), end
+
+
 def weekly_vocab_report(config) -> pd.DataFrame:
-    report = get_stats_by_hw(
-        config, pd.Timestamp.today() - pd.DateOffset(7, "D"), pd.Timestamp.today()
+    start, end = get_window()
+    report = cache.memoize(
+        config,
+        "weekly_vocab_stats",
+        lambda: get_stats_by_hw(config, start, end, recall=False),
+        start,
+        end,
     )
-    return report
+
+    # The predicted recall changes by the hour, so it is never cached
+    return report.join(get_recall(config, report.index))
 
 
 def get_formatted_report(report: pd.DataFrame) -> pd.DataFrame:
@@ -152,6 +160,11 @@ def send_message(service, user_id, message):
 
 
 def authenticate(scopes):
+    # The Google client libraries take a while to import, so only sending does
+    from googleapiclient.discovery import build
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
+
     creds = None
     # The file token.pickle stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
@@ -178,8 +191,16 @@ def authenticate(scopes):
 def process(config):
     service = authenticate(["https://www.googleapis.com/auth/gmail.send"])
 
+    start, end = get_window()
     report = weekly_vocab_report(config)
-    report_message = get_message(report)
+    report_message = cache.memoize(
+        config,
+        "weekly_vocab_message",
+        lambda: get_message(report),
+        start,
+        end,
+        kind="html",
+    )
     report.to_csv(config["attachment"], encoding="utf8")
     message = create_message_with_attachment(
         config["to"], config["subject"], report_message, config["attachment"]
@@ -187,4 +208,5 @@ def process(config):
     send_message(service, "me", message)
 
 
-process(config)
+if __name__ == "__main__":
+    process(config)